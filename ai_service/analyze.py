@@ -0,0 +1,223 @@
+"""Offline analysis of recorded footage.
+
+Splits local video files into time segments that worker processes analyse
+in parallel with the same detection, tracking and classification code as
+the live service, sampling every ``--stride``-th frame, and writes a JSON
+timeline of detections and alert-worthy events:
+
+    python analyze.py incident.mp4 --stride 5 --workers 8 --output timeline.json
+
+Progress goes to stderr. The same analysis backs ``POST /api/analysis``.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+FRAME_STRIDE = 5        # analyse every n-th frame
+SEGMENT_SECONDS = 120   # footage per worker task
+WORKERS = os.cpu_count()
+DEFAULT_FPS = 25.0      # for files that do not report a frame rate
+
+service = None   # the app module, imported in each worker process
+
+
+# -------------------- Planning --------------------
+def plan_segments(paths, segment_seconds=SEGMENT_SECONDS):
+    """Split each video into (start, end) frame ranges of about ``segment_seconds``."""
+    if not math.isfinite(segment_seconds) or segment_seconds <= 0:
+        # Anything smaller than a frame would submit one pool task per frame
+        raise ValueError(f"Segment length must be a positive number of seconds: {segment_seconds}")
+    segments = []
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video: {path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        if total <= 0:
+            # Unknown length: one task reads the whole file
+            segments.append({"video": path, "index": 0, "start": 0, "end": None, "fps": fps})
+            continue
+        step = max(1, round(segment_seconds * fps))
+        for index, start in enumerate(range(0, total, step)):
+            segments.append({"video": path, "index": index, "start": start,
+                             "end": min(start + step, total), "fps": fps})
+    return segments
+
+
+# -------------------- Worker --------------------
+def init_worker(backend, model_path):
+    global service
+    # The service logs with print(); keep it off stdout, which carries the timeline
+    sys.stdout = sys.stderr
+    # Parallelism comes from the processes; keep each one to a single core
+    os.environ.setdefault("TF_NUM_INTRAOP_THREADS", "1")
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+    cv2.setNumThreads(1)
+
+    # The alert dispatcher and evidence store start on first use, so the
+    # live service's spool and evidence folders are never touched from here
+    import app
+    # Only this process submits faces, so waiting for a batch to fill is wasted time
+    app.inference_scheduler.max_wait = 0.0
+    app.model_registry.load(backend or app.INFERENCE_BACKEND, model_path)
+    service = app
+
+
+def analyze_segment(segment, stride, detector):
+    """Run one segment through detection, tracking and classification."""
+    name = os.path.basename(segment["video"])
+    start, end, fps = segment["start"], segment["end"], segment["fps"]
+    tracker = service.FaceTracker()
+    face_detector = service.create_face_detector(detector)
+    detections, events = [], []
+    sampled = 0
+
+    cap = cv2.VideoCapture(segment["video"])
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frame_index = start
+    while end is None or frame_index < end:
+        if (frame_index - start) % stride:
+            # Skipped frames are only demuxed, never converted
+            if not cap.grab():
+                break
+            frame_index += 1
+            continue
+        ok, frame = cap.read()
+        if not ok:
+            break
+
+        seconds = round(frame_index / fps, 3)
+        alerts = service.analyze_frame(name, frame, None, tracker, face_detector)
+        for track in tracker.tracks:
+            if track.missed == 0 and track.probs is not None:
+                detections.append({
+                    "time": seconds,
+                    "frame": frame_index,
+                    "track": f"{segment['index']}:{track.track_id}",
+                    "label": track.label,
+                    "confidence": round(track.confidence, 4),
+                    "box": list(track.box),
+                })
+        for alert in alerts:
+            events.append({
+                "time": seconds,
+                "frame": frame_index,
+                "track": f"{segment['index']}:{alert['track_id']}",
+                "type": alert["type"],
+                "confidence": round(alert["confidence"], 4),
+            })
+        sampled += 1
+        frame_index += 1
+    cap.release()
+
+    return dict(segment, frames_sampled=sampled, detections=detections, events=events)
+
+
+# -------------------- Orchestration --------------------
+def analyze_videos(paths, stride=FRAME_STRIDE, segment_seconds=SEGMENT_SECONDS,
+                   workers=WORKERS, detector="haar", backend=None, model_path=None):
+    """Yield progress and per-segment result records as segments finish.
+
+    Segments complete out of order; every record names its video and
+    frame range so callers can place it on the timeline.
+    """
+    started = time.perf_counter()
+    segments = plan_segments(paths, segment_seconds)
+    yield {"event": "started", "videos": list(paths), "segments": len(segments),
+           "stride": stride, "workers": workers}
+
+    pool = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker, initargs=(backend, model_path)
+    )
+    try:
+        futures = {pool.submit(analyze_segment, seg, stride, detector): seg for seg in segments}
+        for completed, future in enumerate(as_completed(futures), 1):
+            segment = futures[future]
+            try:
+                yield dict(future.result(), event="segment")
+            except Exception as e:
+                yield {"event": "error", "video": segment["video"], "index": segment["index"],
+                       "message": str(e)}
+            yield {"event": "progress", "completed": completed, "total": len(segments),
+                   "elapsed_s": round(time.perf_counter() - started, 2)}
+    finally:
+        # A caller that stops reading (e.g. a closed HTTP stream) cancels the rest
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def build_timeline(records):
+    """Merge segment records into one timeline ordered by video and time."""
+    segments = [r for r in records if r["event"] == "segment"]
+    by_time = lambda item: (item["video"], item["time"])
+    return {
+        "videos": sorted({s["video"] for s in segments}),
+        "frames_sampled": sum(s["frames_sampled"] for s in segments),
+        "events": sorted((dict(e, video=s["video"]) for s in segments for e in s["events"]),
+                         key=by_time),
+        "detections": sorted((dict(d, video=s["video"]) for s in segments for d in s["detections"]),
+                             key=by_time),
+        "errors": [r for r in records if r["event"] == "error"],
+    }
+
+
+# -------------------- CLI --------------------
+def positive_float(value):
+    number = float(value)
+    if not math.isfinite(number) or number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive number: {value}")
+    return number
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyse recorded footage offline")
+    parser.add_argument("videos", nargs="+", help="local video files")
+    parser.add_argument("--stride", type=int, default=FRAME_STRIDE, help="analyse every n-th frame")
+    parser.add_argument("--segment", type=positive_float, default=SEGMENT_SECONDS,
+                        help="seconds of footage per worker task")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--detector", default="haar", choices=["haar", "dnn"])
+    parser.add_argument("--backend", choices=["keras", "tflite", "onnx"])
+    parser.add_argument("--output", help="write the JSON timeline here instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    records = []
+    for record in analyze_videos(args.videos, max(1, args.stride), args.segment,
+                                 args.workers, args.detector, args.backend):
+        records.append(record)
+        if record["event"] == "progress":
+            print(f"[INFO] {record['completed']}/{record['total']} segments "
+                  f"({record['elapsed_s']}s)", file=sys.stderr)
+        elif record["event"] == "error":
+            print(f"[ERROR] {record['video']} segment {record['index']}: {record['message']}",
+                  file=sys.stderr)
+
+    timeline = build_timeline(records)
+    timeline["stride"] = args.stride
+    timeline["elapsed_s"] = round(time.perf_counter() - started, 2)
+
+    output = json.dumps(timeline, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print("Timeline saved to", args.output, file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,252 +1,2445 @@
 import os
-import sys
 import time
 import json
 import base64
+import hmac
+import itertools
+import multiprocessing
+import queue
+import random
 import threading
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime
+from multiprocessing import shared_memory
 
 import cv2
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.layers import Rescaling
 from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import requests   # ← Added for Node.js API alerts
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 
 # ------------- Configuration -------------
 CLASSES = ['normal face', 'with helmet', 'with mask']
 IMG_SIZE = 224
 CONFIDENCE_THRESHOLD = 0.7
 ALERT_COOLDOWN = 30
-CAMERAS = []
+ALERT_STORE_SIZE = 10000    # alerts kept in memory for /api/alerts/*
+ALERT_RECENT_LIMIT = 10     # default size of /api/alerts/recent
+FRAME_WAIT_TIMEOUT = 5.0   # seconds a viewer waits for the next frame
+CAPTURE_LATEST_ONLY = True  # live sources keep only their newest frame; files are read in order
+CAPTURE_LATENCY_BUDGET = 0.5  # seconds a captured frame may wait for processing before it is dropped
+CAPTURE_STALL_TIMEOUT = 10.0  # seconds without a frame before a live source counts as failed
+CAPTURE_OPEN_TIMEOUT = 10.0  # seconds a network stream may take to open
+CAPTURE_READ_TIMEOUT = 5.0   # seconds a blocked network read waits before failing
+CAMERA_OPEN_CONCURRENCY = 16  # live streams being opened at the same time
+RECONNECT_BASE_DELAY = 1.0  # seconds before the first reconnect, doubled after each failure
+RECONNECT_MAX_DELAY = 60.0
+TRACK_IOU_THRESHOLD = 0.3   # minimum overlap to match a face to an existing track
+TRACK_MAX_MISSED = 15       # frames a track survives without a matching face
+TRACK_RECLASSIFY_EVERY = 10 # frames between classifier calls for one track
+TRACK_RECLASSIFY_IOU = 0.5  # reclassify early once the box drifts below this overlap
+TRACK_SMOOTHING = 0.6       # weight of the previous probabilities in the running average
+FRAME_HISTORY_SIZE = 30     # annotated frames kept per camera for snapshots, as JPEG
+FRAME_HISTORY_INTERVAL = 1.0  # seconds between frames kept in the history
+STREAM_PROFILES = {          # MJPEG output tiers, picked with /video_feed/<id>?profile=
+    "full": {"width": None, "quality": 80, "fps": None},
+    "medium": {"width": 640, "quality": 75, "fps": 15},
+    "thumb": {"width": 320, "quality": 60, "fps": 5},
+}
+DEFAULT_STREAM_PROFILE = "full"
+SNAPSHOT_WORKERS = 8        # cameras encoded in parallel by /api/cameras/snapshots
+SNAPSHOT_BATCH_LIMIT = 200  # cameras per batch snapshot request
+MOTION_GATE_ENABLED = True   # skip detection while the scene is static
+MOTION_METHOD = "mog2"      # "mog2" background subtraction or "diff" frame differencing
+MOTION_SENSITIVITY = 0.8    # default per camera, 0..1; overridden by "motionSensitivity"
+MOTION_MAX_AREA = 0.02      # changed-pixel fraction needed at sensitivity 0
+MOTION_FRAME_WIDTH = 160    # width of the downscaled frame the gate looks at
+MOTION_HOLD_SECONDS = 3.0   # keep detecting this long after the last motion
+FACE_DETECTOR = "haar"      # default detector, "haar" or "dnn"; overridden by "detector"
+DETECTION_WIDTH = 640       # frames wider than this are downscaled before detection
+DNN_PROTOTXT = "deploy.prototxt"
+DNN_WEIGHTS = "res10_300x300_ssd_iter_140000.caffemodel"
+DNN_CONFIDENCE = 0.6
+INFERENCE_BACKEND = "keras"  # "keras", "tflite" or "onnx"
+INFERENCE_MAX_BATCH = 32    # faces per model call across all cameras
+INFERENCE_MAX_WAIT_MS = 10  # how long a batch may wait to fill up
+INFERENCE_RESULT_TIMEOUT = 30.0  # seconds a frame waits for its predictions before failing
+CAMERA_PROCESSES = 0        # >0 shards cameras across this many worker processes
+SHARED_FRAME_SLOTS = 3      # frames per camera ring in shared memory
+SHARED_POLL_INTERVAL = 0.005  # seconds between checks of the shared rings
+SHARD_STATUS_INTERVAL = 2.0 # seconds between status reports from shard processes
+SHARD_RESTART_DELAY = 5.0   # seconds before a crashed shard is restarted
+SHARD_RELOAD_TIMEOUT = 120.0  # seconds to wait for every shard to swap models
+MODEL_WARMUP_RUNS = 3       # inferences per batch size before a model takes traffic
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+ADMIN_TOKEN = os.environ.get("AI_ADMIN_TOKEN")  # required by admin actions; they are disabled when unset
+FOOTAGE_DIR = os.environ.get("AI_FOOTAGE_DIR", os.path.join(MODEL_DIR, "footage"))  # /api/analysis inputs
+ALERT_API_URL = 'http://localhost:3001/api/alerts'
+ALERT_QUEUE_SIZE = 256      # alerts waiting for delivery before new ones go to the spool
+ALERT_OVERFLOW_SIZE = 5000  # alerts held for the spool while the queue is full, then dropped
+ALERT_BATCH_SIZE = 20       # alerts drained per delivery round
+ALERT_TIMEOUT = 5
+ALERT_MAX_RETRIES = 4
+ALERT_RETRY_BACKOFF = 1.0   # seconds, doubled after every failed attempt
+ALERT_SPOOL_DIR = "alert_spool"
+ALERT_SPOOL_RETRY = 30      # seconds between spool replays while idle
+EVIDENCE_DIR = "alert_images"
+EVIDENCE_QUEUE_SIZE = 128   # evidence images waiting to be written before new ones are dropped
+EVIDENCE_CROP_MARGIN = 0.25 # padding around the face box, as a fraction of its larger side
+EVIDENCE_THUMB_WIDTH = 320  # width of the full-frame thumbnail
+EVIDENCE_JPEG_QUALITY = 90  # face crop
+EVIDENCE_THUMB_QUALITY = 70
+EVIDENCE_DEDUP_DISTANCE = 6 # max differing bits of the 64-bit face hash for a duplicate
+EVIDENCE_DEDUP_WINDOW = 120 # seconds a camera's recent evidence is compared against
+EVIDENCE_DEDUP_RECENT = 8   # recent evidence images per camera compared against
+EVIDENCE_CAMERA_QUOTA_MB = 500
+EVIDENCE_TOTAL_QUOTA_MB = 5000
+EVIDENCE_MAX_AGE_DAYS = 30
+EVIDENCE_SWEEP_INTERVAL = 600  # seconds between age sweeps while idle
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRIC_WINDOW = 512         # recent samples per stage kept for percentiles
+
+
+app = Flask(__name__)
+CORS(app)
+
+
+# ------------- Global Variables -------------
+camera_status = {}
+camera_workers = {}
+camera_workers_lock = threading.Lock()
+
+
+# ------------- Metrics -------------
+class StageHistogram:
+    def __init__(self):
+        self.buckets = [0] * len(METRIC_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=METRIC_WINDOW)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(METRIC_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))] * 1000, 3)
+
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": pct(0.50) if recent else 0.0,
+            "p95_ms": pct(0.95) if recent else 0.0,
+            "p99_ms": pct(0.99) if recent else 0.0,
+        }
+
+
+class PipelineMetrics:
+    """Per-stage latency histograms, per-camera counters and queue gauges.
+
+    Stages: capture, detect, preprocess, predict, annotate, encode, evidence
+    and alert_dispatch, plus latency from capture to publish. ``render_prometheus()``
+    backs ``/metrics``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}   # (stage, camera) -> StageHistogram
+        self._counters = {} # (name, camera) -> int
+        self._fps = {}      # camera -> (last tick, smoothed fps)
+        self._gauges = {}   # queue name -> callable returning its depth
+
+    def observe(self, stage, seconds, camera=None):
+        with self._lock:
+            hist = self._stages.get((stage, camera))
+            if hist is None:
+                hist = self._stages[(stage, camera)] = StageHistogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, camera=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, camera)
+
+    def inc(self, name, camera=None, amount=1):
+        with self._lock:
+            self._counters[(name, camera)] = self._counters.get((name, camera), 0) + amount
+
+    def counter(self, name, camera=None):
+        with self._lock:
+            return self._counters.get((name, camera), 0)
+
+    def tick(self, camera):
+        """Record one processed frame for the camera's FPS estimate."""
+        now = time.monotonic()
+        with self._lock:
+            last, fps = self._fps.get(camera, (None, 0.0))
+            if last is not None and now > last:
+                fps = 1.0 / (now - last) if fps == 0.0 else 0.9 * fps + 0.1 / (now - last)
+            self._fps[camera] = (now, fps)
+
+    def register_queue(self, name, depth):
+        self._gauges[name] = depth
+
+    def queue_depths(self):
+        return {name: depth() for name, depth in self._gauges.items()}
+
+    def camera_summary(self, camera):
+        with self._lock:
+            last, fps = self._fps.get(camera, (None, 0.0))
+            if last is not None and time.monotonic() - last > FRAME_WAIT_TIMEOUT:
+                fps = 0.0
+            counters = {name: value for (name, cam), value in self._counters.items() if cam == camera}
+            stages = {stage: hist.summary() for (stage, cam), hist in self._stages.items() if cam == camera}
+        return {"fps": round(fps, 2), "counters": counters, "stages": stages}
+
+    def snapshot(self):
+        """Raw histograms, counters, FPS and queue depths, for relaying from shard processes."""
+        with self._lock:
+            stages = {key: (list(h.buckets), h.count, h.total) for key, h in self._stages.items()}
+            counters = dict(self._counters)
+            fps = {camera: value for camera, (_, value) in self._fps.items()}
+        return {"stages": stages, "counters": counters, "fps": fps, "queues": self.queue_depths()}
+
+    def render_prometheus(self, remote=()):
+        """Render this process's metrics merged with ``snapshot()`` dicts from shards."""
+        def labels(**kwargs):
+            pairs = [
+                '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                for k, v in kwargs.items() if v is not None
+            ]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = [
+            "# HELP guardai_stage_seconds Pipeline stage latency.",
+            "# TYPE guardai_stage_seconds histogram",
+        ]
+        local = self.snapshot()
+        stages, counters, fps, queues = (local["stages"], local["counters"],
+                                         local["fps"], local["queues"])
+        for snapshot in remote:
+            # Global series such as predict exist in every shard and add up
+            for key, (buckets, count, total) in snapshot["stages"].items():
+                if key in stages:
+                    mine = stages[key]
+                    buckets = [a + b for a, b in zip(mine[0], buckets)]
+                    count, total = mine[1] + count, mine[2] + total
+                stages[key] = (buckets, count, total)
+            for key, value in snapshot["counters"].items():
+                counters[key] = counters.get(key, 0) + value
+            fps.update(snapshot["fps"])
+            for name, depth in snapshot["queues"].items():
+                queues[name] = queues.get(name, 0) + depth
+
+        for (stage, camera), (buckets, count, total) in sorted(stages.items(), key=lambda s: (s[0][0], str(s[0][1]))):
+            cumulative = 0
+            for bound, n in zip(METRIC_BUCKETS, buckets):
+                cumulative += n
+                lines.append(f"guardai_stage_seconds_bucket{labels(stage=stage, camera=camera, le=bound)} {cumulative}")
+            lines.append(f"guardai_stage_seconds_bucket{labels(stage=stage, camera=camera, le='+Inf')} {count}")
+            lines.append(f"guardai_stage_seconds_sum{labels(stage=stage, camera=camera)} {total}")
+            lines.append(f"guardai_stage_seconds_count{labels(stage=stage, camera=camera)} {count}")
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE guardai_{name}_total counter")
+            for (counter, camera), value in counters.items():
+                if counter == name:
+                    lines.append(f"guardai_{name}_total{labels(camera=camera)} {value}")
+
+        lines.append("# TYPE guardai_camera_fps gauge")
+        for camera, value in fps.items():
+            lines.append(f"guardai_camera_fps{labels(camera=camera)} {value:.3f}")
+
+        lines.append("# TYPE guardai_queue_depth gauge")
+        for name, depth in queues.items():
+            lines.append(f"guardai_queue_depth{labels(queue=name)} {depth}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = PipelineMetrics()
+
+
+# ------------- Inference Backends -------------
+# TensorFlow is imported by the backends that need it, on the registry's
+# loader thread, so importing this module stays fast.
+#
+# Every backend takes a uint8 BGR batch of IMG_SIZE faces straight from the
+# frame and does the flip to RGB and the 1/255 scaling itself, in the graph
+# or into a reused input buffer.
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, path):
+        import tensorflow as tf
+        from tensorflow.keras.layers import Rescaling
+
+        custom_objects = {"Rescaling": Rescaling}
+        self.model = tf.keras.models.load_model(path, custom_objects=custom_objects)
+
+        @tf.function(input_signature=[tf.TensorSpec((None, IMG_SIZE, IMG_SIZE, 3), tf.uint8)])
+        def predict_bgr(batch):
+            images = tf.reverse(tf.cast(batch, tf.float32) * (1.0 / 255.0), axis=[-1])
+            return self.model(images, training=False)
+
+        self._predict = predict_bgr
+
+    def predict(self, batch):
+        return self._predict(batch).numpy()
+
+
+class TFLiteBackend:
+    """TFLite interpreter, handling both float and INT8-quantized exports.
+
+    Batches are padded up to one of a few fixed sizes, each with its own
+    interpreter allocated once, so the scheduler's varying batch sizes
+    never trigger a tensor reallocation.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self._Interpreter = Interpreter
+        self._model_path = path
+        self._sizes = sorted({1, INFERENCE_MAX_BATCH})
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        interpreter = self._interpreter(self._sizes[0])
+        self.input = interpreter.get_input_details()[0]
+        self.output = interpreter.get_output_details()[0]
+
+        dtype = self.input["dtype"]
+        self._lut = None
+        if dtype != np.float32:
+            # Quantizing a 0-255 pixel only has 256 possible results
+            scale, zero_point = self.input["quantization"]
+            levels = np.arange(256, dtype=np.float32) / 255.0
+            self._lut = np.clip(np.round(levels / scale + zero_point),
+                                np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+
+    def _interpreter(self, size):
+        interpreter = self._interpreters.get(size)
+        if interpreter is None:
+            interpreter = self._Interpreter(model_path=self._model_path, num_threads=os.cpu_count())
+            input_index = interpreter.get_input_details()[0]["index"]
+            interpreter.resize_tensor_input(input_index, (size, IMG_SIZE, IMG_SIZE, 3))
+            interpreter.allocate_tensors()
+            self._interpreters[size] = interpreter
+        return interpreter
+
+    def predict(self, batch):
+        count = len(batch)
+        size = next((size for size in self._sizes if size >= count), None)
+        if size is None:
+            step = self._sizes[-1]
+            return np.concatenate([self.predict(batch[i:i + step]) for i in range(0, count, step)])
+
+        rgb = batch[..., ::-1]
+        with self._lock:
+            interpreter = self._interpreter(size)
+            # Fill the interpreter's own input tensor instead of staging a copy;
+            # padding rows keep stale data and their outputs are sliced off
+            tensor = interpreter.tensor(self.input["index"])()[:count]
+            if self._lut is not None:
+                tensor[...] = self._lut[rgb]
+            else:
+                np.multiply(rgb, np.float32(1.0 / 255.0), out=tensor, casting="unsafe")
+            del tensor   # invoke() refuses to run while views into its buffers exist
+
+            interpreter.invoke()
+            preds = interpreter.get_tensor(self.output["index"])[:count]
+
+        if self.output["dtype"] != np.float32:
+            scale, zero_point = self.output["quantization"]
+            preds = (preds.astype(np.float32) - zero_point) * scale
+        return preds
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path):
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed")
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self._input = np.empty((INFERENCE_MAX_BATCH, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        with self._lock:
+            if len(batch) > len(self._input):
+                self._input = np.empty((len(batch),) + self._input.shape[1:], dtype=np.float32)
+            tensor = self._input[:len(batch)]
+            np.multiply(batch[..., ::-1], np.float32(1.0 / 255.0), out=tensor, casting="unsafe")
+            return self.session.run(None, {self.input_name: tensor})[0]
+
+
+INFERENCE_BACKENDS = {
+    "keras": (KerasBackend, ["face_model_finetuned.h5", "face_model.h5"]),
+    "tflite": (TFLiteBackend, ["face_model_int8.tflite", "face_model.tflite"]),
+    "onnx": (OnnxBackend, ["face_model.onnx"]),
+}
+
+
+def load_inference_backend(name, path=None):
+    backend_cls, paths = INFERENCE_BACKENDS[name]
+    for path in ([path] if path else paths):
+        if os.path.exists(path):
+            try:
+                backend = backend_cls(path)
+                backend.path = path
+                print(f"[INFO] Loaded {name} model: {path}")
+                return backend
+            except Exception as e:
+                print(f"[WARNING] Failed loading {path}: {e}")
+    return None
+
+
+# ------------- Model Registry -------------
+class ModelRegistry:
+    """Holds the active classifier and swaps in new ones without downtime.
+
+    A new backend is loaded and warmed up while the current one keeps
+    serving; the swap itself is a single reference change under a lock,
+    so in-flight batches finish on the model they started with.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loading = False
+        self.info = {"ready": False, "backend": None, "path": None}
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def backend_name(self):
+        backend = self._backend
+        return backend.name if backend else None
+
+    def status(self):
+        return dict(self.info, ready=self.ready, loading=self._loading)
+
+    def ensure_loading(self):
+        """Start the initial background load if nothing is loaded yet."""
+        with self._lock:
+            if self._backend is not None or self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._initial_load, name="model-loader", daemon=True).start()
+
+    def _initial_load(self):
+        try:
+            self.load(INFERENCE_BACKEND)
+        except RuntimeError:
+            if INFERENCE_BACKEND == "keras":
+                print("[ERROR] No model found. Train and save a model first.")
+                return
+            print(f"[WARNING] No usable {INFERENCE_BACKEND} model, falling back to keras")
+            try:
+                self.load("keras")
+            except RuntimeError:
+                print("[ERROR] No model found. Train and save a model first.")
+        finally:
+            self._loading = False
+
+    def _warm_up(self, backend):
+        start = time.perf_counter()
+        for batch_size in sorted({1, INFERENCE_MAX_BATCH}):
+            batch = np.zeros((batch_size, IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+            for _ in range(MODEL_WARMUP_RUNS):
+                backend.predict(batch)
+        return (time.perf_counter() - start) * 1000
+
+    def load(self, name, path=None):
+        """Load, warm up and activate a backend; raises RuntimeError on failure."""
+        with self._load_lock:
+            self._loading = True
+            try:
+                backend = load_inference_backend(name, path)
+                if backend is None:
+                    raise RuntimeError(f"Could not load {name} model from {path or 'default paths'}")
+                warmup_ms = self._warm_up(backend)
+            finally:
+                self._loading = False
+
+            with self._lock:
+                self._backend = backend
+                self.info = {
+                    "backend": name,
+                    "path": backend.path,
+                    "loaded_at": datetime.now().isoformat(),
+                    "warmup_ms": round(warmup_ms, 1),
+                }
+            self._ready.set()
+            print(f"[INFO] Activated {name} model {backend.path} (warm-up {warmup_ms:.0f} ms)")
+            return self.status()
+
+    def predict(self, batch):
+        if not self._ready.wait(FRAME_WAIT_TIMEOUT):
+            raise RuntimeError("No model loaded")
+        return self._backend.predict(batch)
+
+
+model_registry = ModelRegistry()
+
+
+# ------------- Inference Scheduler -------------
+class InferenceScheduler:
+    """Collects face crops from every camera into shared model calls.
+
+    Each ``submit()`` carries all faces from one frame; requests are
+    merged until ``max_batch`` faces are queued or ``max_wait_ms`` has
+    passed since the first one arrived, then the predictions are split
+    back to the callers in submission order.
+    """
+
+    def __init__(self, max_batch=INFERENCE_MAX_BATCH, max_wait_ms=INFERENCE_MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._batch = np.empty((max_batch, IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="inference", daemon=True)
+        self._thread.start()
+
+    def submit(self, faces):
+        future = Future()
+        if len(faces) == 0:
+            future.set_result(np.empty((0, len(CLASSES)), dtype=np.float32))
+        else:
+            self._queue.put((faces, future))
+        return future
+
+    def predict(self, faces, timeout=INFERENCE_RESULT_TIMEOUT):
+        # A stuck or dead scheduler shows up as an inference error, not a hung camera
+        try:
+            return self.submit(faces).result(timeout=timeout)
+        except FutureTimeoutError:
+            raise RuntimeError(f"No predictions within {timeout:.0f}s") from None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[0])
+
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            size = sum(len(faces) for faces, _ in pending)
+            try:
+                if len(pending) == 1:
+                    batch = pending[0][0]
+                elif size <= self.max_batch:
+                    # Callers keep their buffers until their future resolves
+                    batch = np.concatenate([faces for faces, _ in pending], out=self._batch[:size])
+                else:
+                    batch = np.concatenate([faces for faces, _ in pending])
+
+                with metrics.timer("predict"):
+                    preds = model_registry.predict(batch)
+                metrics.inc("inference_calls")
+                metrics.inc("inference_faces", amount=len(batch))
+            except Exception as e:
+                print(f"[ERROR] Inference failed for batch of {size}: {e}")
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for faces, future in pending:
+                future.set_result(preds[offset:offset + len(faces)])
+                offset += len(faces)
+
+
+inference_scheduler = InferenceScheduler()
+metrics.register_queue("inference", inference_scheduler.pending)
+
+
+# ------------- Face Detector -------------
+HAAR_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+face_cascade = cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+
+
+class HaarFaceDetector:
+    name = "haar"
+
+    def __init__(self, cascade=None):
+        self.cascade = cascade if cascade is not None else cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+
+    def detect(self, image, scale=1.0):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        min_side = max(24, int(60 * scale))
+        return self.cascade.detectMultiScale(
+            gray, scaleFactor=1.1, minNeighbors=4, minSize=(min_side, min_side)
+        )
+
+
+class DnnFaceDetector:
+    """OpenCV's ResNet-10 SSD face detector loaded from local model files."""
+
+    name = "dnn"
+
+    def __init__(self, prototxt=DNN_PROTOTXT, weights=DNN_WEIGHTS, confidence=DNN_CONFIDENCE):
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, weights)
+        self.confidence = confidence
+
+    def detect(self, image, scale=1.0):
+        h, w = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(image, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()
+
+        boxes = []
+        for det in detections[0, 0]:
+            if det[2] < self.confidence:
+                continue
+            x1, y1 = max(0, int(det[3] * w)), max(0, int(det[4] * h))
+            x2, y2 = min(w, int(det[5] * w)), min(h, int(det[6] * h))
+            if x2 > x1 and y2 > y1:
+                boxes.append((x1, y1, x2 - x1, y2 - y1))
+        return boxes
+
+
+def create_face_detector(name=FACE_DETECTOR):
+    if name == "dnn":
+        try:
+            return DnnFaceDetector()
+        except cv2.error as e:
+            print(f"[WARNING] Failed loading DNN face detector, using haar: {e}")
+    return HaarFaceDetector()
+
+
+class RegionOfInterest:
+    """Polygon in normalized (0..1) frame coordinates restricting detection."""
+
+    def __init__(self, points):
+        try:
+            points = np.asarray(points, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise ValueError("ROI must be a list of [x, y] points") from None
+        if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+            raise ValueError("ROI must be a list of at least 3 [x, y] points")
+        if not np.isfinite(points).all():
+            raise ValueError("ROI points must be finite numbers")
+        self.points = points
+        self._shape = None
+        self._polygon = None
+
+    def _fit(self, shape):
+        if shape != self._shape:
+            h, w = shape[:2]
+            self._polygon = (self.points * [w, h]).astype(np.int32)
+            self._shape = shape
+        return self._polygon
+
+    def bounds(self, shape):
+        """Bounding box of the polygon, clipped to the frame."""
+        x, y, w, h = cv2.boundingRect(self._fit(shape))
+        return max(0, x), max(0, y), min(shape[1], x + w), min(shape[0], y + h)
+
+    def contains(self, shape, box):
+        x, y, w, h = box
+        center = (float(x + w / 2), float(y + h / 2))
+        return cv2.pointPolygonTest(self._fit(shape), center, False) >= 0
+
+
+def detect_faces(frame, detector, roi=None):
+    """Run ``detector`` on a downscaled, ROI-cropped copy of ``frame``.
+
+    Boxes are mapped back to full-resolution frame coordinates.
+    """
+    x0, y0, x1, y1 = (0, 0, frame.shape[1], frame.shape[0])
+    if roi is not None:
+        x0, y0, x1, y1 = roi.bounds(frame.shape)
+    region = frame[y0:y1, x0:x1]
+    if region.size == 0:
+        return []
+
+    scale = min(1.0, DETECTION_WIDTH / float(region.shape[1]))
+    if scale < 1.0:
+        region = cv2.resize(region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    faces = []
+    for (x, y, w, h) in detector.detect(region, scale):
+        box = (int(x / scale) + x0, int(y / scale) + y0, int(w / scale), int(h / scale))
+        if roi is None or roi.contains(frame.shape, box):
+            faces.append(box)
+    return faces
+
+
+default_face_detector = HaarFaceDetector(face_cascade)
+
+
+# ------------- Alert Dispatcher -------------
+class AlertDispatcher:
+    """Delivers alerts to the Node.js API without blocking the frame loop.
+
+    Alerts are queued with ``enqueue()``; a background worker posts them
+    over a pooled session with exponential backoff and spools anything
+    still undelivered to disk, replaying the spool once the API is
+    reachable again. Alerts arriving while the queue is full are handed
+    to the worker to spool rather than dropped. Evidence images are written by the EvidenceStore.
+    """
+
+    def __init__(self, url=ALERT_API_URL, maxsize=ALERT_QUEUE_SIZE):
+        self.url = url
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._overflow = []
+        self._overflow_lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self.spool_path = os.path.join(ALERT_SPOOL_DIR, "pending.jsonl")
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the delivery thread; called by the service and on the first alert.
+
+        Importing the module must not touch the spool, so processes that
+        never send alerts (analysis workers, benchmarks) leave it alone.
+        """
+        with self._start_lock:
+            if self._thread is None:
+                os.makedirs(os.path.dirname(self.spool_path), exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+                self._thread.start()
+        return self
+
+    def enqueue(self, alert_data):
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(alert_data)
+            return True
+        except queue.Full:
+            pass
+
+        with self._overflow_lock:
+            if len(self._overflow) < ALERT_OVERFLOW_SIZE:
+                # The worker is stuck retrying: it spools these after its current round
+                self._overflow.append(alert_data)
+                metrics.inc("alerts_overflowed", alert_data["cameraId"])
+                return True
+        self.dropped += 1
+        metrics.inc("alerts_dropped", alert_data["cameraId"])
+        print(f"[WARNING] Alert queue and overflow full, dropped alert: {alert_data['type']}")
+        return False
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _post(self, alert_data):
+        """Return True once delivered, False to retry, None if the API rejected it."""
+        try:
+            with metrics.timer("alert_dispatch", alert_data["cameraId"]):
+                response = self._session.post(self.url, json=alert_data, timeout=ALERT_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            print(f"[ERROR] Failed to send alert to API: {e}")
+            return False
+
+        if response.status_code == 201:
+            print(f"[SUCCESS] Alert sent to API: {alert_data['type']}")
+            return True
+
+        print(f"[ERROR] Failed to send alert. Status: {response.status_code}")
+        print(f"Response: {response.text}")
+        return None if 400 <= response.status_code < 500 else False
+
+    def _deliver(self, batch):
+        pending = batch
+        for attempt in range(ALERT_MAX_RETRIES):
+            if attempt:
+                time.sleep(ALERT_RETRY_BACKOFF * 2 ** (attempt - 1))
+            for index, alert in enumerate(pending):
+                if self._post(alert) is False:
+                    # The API is down or timing out: the rest waits for the next attempt untried
+                    pending = pending[index:]
+                    break
+            else:
+                return True
+
+        self._spool(pending)
+        return False
+
+    def _spool(self, alerts):
+        try:
+            with open(self.spool_path, "a") as f:
+                for alert in alerts:
+                    f.write(json.dumps(alert) + "\n")
+            print(f"[WARNING] Spooled {len(alerts)} undelivered alert(s) to {self.spool_path}")
+        except OSError as e:
+            print(f"[ERROR] Failed to spool alerts: {e}")
+
+    def _read_spool(self):
+        """Parse the spool, moving lines that are not alerts aside instead of failing."""
+        spooled, corrupt = [], []
+        with open(self.spool_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    alert = json.loads(line)
+                except ValueError:
+                    alert = None
+                if isinstance(alert, dict) and "cameraId" in alert and "type" in alert:
+                    spooled.append(alert)
+                else:
+                    # e.g. a line cut short by a crash while spooling
+                    corrupt.append(line if line.endswith("\n") else line + "\n")
+
+        if corrupt:
+            with open(self.spool_path + ".corrupt", "a") as f:
+                f.writelines(corrupt)
+            print(f"[WARNING] Moved {len(corrupt)} unreadable spool line(s) to "
+                  f"{self.spool_path}.corrupt")
+        return spooled
+
+    def _replay_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+        spooled = self._read_spool()
+
+        remaining = []
+        for index, alert in enumerate(spooled):
+            if self._post(alert) is False:
+                remaining = spooled[index:]
+                break
+
+        if remaining:
+            tmp_path = self.spool_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(json.dumps(alert) + "\n" for alert in remaining)
+            os.replace(tmp_path, self.spool_path)
+        else:
+            os.remove(self.spool_path)
+            if spooled:
+                print(f"[INFO] Replayed {len(spooled)} spooled alert(s)")
+
+    def _deliver_round(self):
+        try:
+            batch = [self._queue.get(timeout=ALERT_SPOOL_RETRY)]
+        except queue.Empty:
+            self._replay_spool()
+            return
+
+        while len(batch) < ALERT_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # The API only accepts one alert per request, so a batch shares
+        # the pooled connection rather than a single POST body.
+        if self._deliver(batch):
+            self._replay_spool()
+
+    def _flush_overflow(self):
+        with self._overflow_lock:
+            overflow, self._overflow = self._overflow, []
+        if overflow:
+            self._spool(overflow)
+
+    def _run(self):
+        while True:
+            try:
+                self._deliver_round()
+                self._flush_overflow()
+            except Exception as e:
+                # A bad round must not stop delivery for the rest of the process
+                print(f"[ERROR] Alert delivery round failed: {e}")
+
+
+alert_dispatcher = AlertDispatcher()
+metrics.register_queue("alerts", alert_dispatcher.pending)
+
+
+# ------------- Evidence Store -------------
+def perceptual_hash(image):
+    """64-bit difference hash; near-identical images differ in only a few bits."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+class EvidenceStore:
+    """Writes alert evidence in the background and keeps it within quota.
+
+    ``capture()`` runs on the frame loop and only crops the face, shrinks
+    a thumbnail and checks the face hash against the camera's recent
+    evidence. Files are written under ``<root>/<camera_id>/`` by a writer
+    thread, which also evicts the oldest files once a camera or the whole
+    store exceeds its quota or EVIDENCE_MAX_AGE_DAYS.
+    """
+
+    def __init__(self, root=EVIDENCE_DIR, maxsize=EVIDENCE_QUEUE_SIZE):
+        self.root = root
+        self.camera_quota = EVIDENCE_CAMERA_QUOTA_MB * 1024 * 1024
+        self.total_quota = EVIDENCE_TOTAL_QUOTA_MB * 1024 * 1024
+        self.camera_filter = None   # set in shard processes to index only their cameras
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._overflow = []
+        self._overflow_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._recent = {}           # camera -> deque of (time, hash, paths)
+        self._files = {}            # camera -> deque of (mtime, size, path), oldest first
+        self._camera_bytes = {}
+        self._total_bytes = 0
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the writer thread, which indexes and enforces quota on ``root``."""
+        with self._start_lock:
+            if self._thread is None:
+                os.makedirs(self.root, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="evidence-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def capture(self, camera_id, alert_id, frame, box=None):
+        """Return the (image, thumbnail) paths for an alert, or (None, None) if dropped."""
+        if self._thread is None:
+            self.start()
+        height, width = frame.shape[:2]
+        if box is None:
+            crop = frame.copy()
+        else:
+            x, y, w, h = box
+            pad = int(EVIDENCE_CROP_MARGIN * max(w, h))
+            crop = frame[max(0, y - pad):min(height, y + h + pad),
+                         max(0, x - pad):min(width, x + w + pad)].copy()
+        face_hash = perceptual_hash(crop)
+        now = time.time()
+
+        with self._lock:
+            recent = self._recent.setdefault(camera_id, deque(maxlen=EVIDENCE_DEDUP_RECENT))
+            for stamp, previous_hash, paths in recent:
+                if (now - stamp <= EVIDENCE_DEDUP_WINDOW
+                        and bin(face_hash ^ previous_hash).count("1") <= EVIDENCE_DEDUP_DISTANCE):
+                    # Same face as evidence already saved: point the alert at it
+                    metrics.inc("evidence_deduplicated", camera_id)
+                    return paths
+
+        if width > EVIDENCE_THUMB_WIDTH:
+            thumb_size = (EVIDENCE_THUMB_WIDTH, round(height * EVIDENCE_THUMB_WIDTH / width))
+            thumbnail = cv2.resize(frame, thumb_size, interpolation=cv2.INTER_AREA)
+        else:
+            thumbnail = frame.copy()
+
+        folder = os.path.join(self.root, camera_id)
+        paths = (os.path.join(folder, f"{alert_id}.jpg"),
+                 os.path.join(folder, f"{alert_id}_thumb.jpg"))
+        try:
+            self._queue.put_nowait((camera_id, paths, crop, thumbnail))
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc("evidence_dropped", camera_id)
+            print(f"[WARNING] Evidence queue full, dropped images for: {alert_id}")
+            return None, None
+
+        with self._lock:
+            recent.append((now, face_hash, paths))
+        return paths
+
+    def _scan(self):
+        """Index files already on disk, e.g. from before a restart."""
+        for name in os.listdir(self.root):
+            folder = os.path.join(self.root, name)
+            if os.path.isdir(folder):
+                if self.camera_filter is not None and not self.camera_filter(name):
+                    continue
+                paths, camera_id = [os.path.join(folder, f) for f in os.listdir(folder)], name
+            else:
+                # Flat files from before per-camera folders only count toward the total
+                if self.camera_filter is not None:
+                    continue
+                paths, camera_id = [folder], ""
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                self._index(camera_id, stat.st_mtime, stat.st_size, path)
+
+        for files in self._files.values():
+            files_sorted = sorted(files)
+            files.clear()
+            files.extend(files_sorted)
+
+    def _index(self, camera_id, mtime, size, path):
+        self._files.setdefault(camera_id, deque()).append((mtime, size, path))
+        self._camera_bytes[camera_id] = self._camera_bytes.get(camera_id, 0) + size
+        self._total_bytes += size
+
+    def _evict(self, camera_id):
+        files = self._files[camera_id]
+        _, size, path = files.popleft()
+        self._camera_bytes[camera_id] -= size
+        self._total_bytes -= size
+        if not files:
+            del self._files[camera_id]
+            del self._camera_bytes[camera_id]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[WARNING] Failed to evict evidence {path}: {e}")
+        metrics.inc("evidence_evicted", camera_id or None)
+
+    def _enforce_quota(self, camera_id=None):
+        oldest_allowed = time.time() - EVIDENCE_MAX_AGE_DAYS * 86400
+        for cam_id in list(self._files):
+            while cam_id in self._files and self._files[cam_id][0][0] < oldest_allowed:
+                self._evict(cam_id)
+
+        if camera_id is not None:
+            while camera_id in self._files and self._camera_bytes[camera_id] > self.camera_quota:
+                self._evict(camera_id)
+
+        while self._files and self._total_bytes > self.total_quota:
+            self._evict(min(self._files, key=lambda cam_id: self._files[cam_id][0][0]))
+
+    def _write(self, camera_id, paths, crop, thumbnail):
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        qualities = (EVIDENCE_JPEG_QUALITY, EVIDENCE_THUMB_QUALITY)
+        for path, image, quality in zip(paths, (crop, thumbnail), qualities):
+            try:
+                if not cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+                    raise OSError("encoder refused the image")
+                self._index(camera_id, time.time(), os.path.getsize(path), path)
+            except Exception as e:
+                print(f"[WARNING] Failed to save alert image {os.path.basename(path)}: {e}")
+
+    def _run(self):
+        scanned = False
+        while True:
+            try:
+                item = self._queue.get(timeout=EVIDENCE_SWEEP_INTERVAL)
+            except queue.Empty:
+                item = None
+
+            # Deferred so shard processes have set camera_filter first
+            if not scanned:
+                scanned = True
+                try:
+                    self._scan()
+                except OSError as e:
+                    print(f"[WARNING] Failed to index evidence in {self.root}: {e}")
+
+            if item is None:
+                self._enforce_quota()
+                continue
+
+            camera_id, paths, crop, thumbnail = item
+
+            with metrics.timer("evidence", camera_id):
+                self._write(camera_id, paths, crop, thumbnail)
+            self._enforce_quota(camera_id)
+
+
+evidence_store = EvidenceStore()
+metrics.register_queue("evidence", evidence_store.pending)
+
+
+# ------------- Alert Store -------------
+class AlertStore:
+    """Capacity-bounded ring of raised alerts, indexed by camera and type.
+
+    Alerts are appended in arrival order, so every index is an ordered
+    subsequence of the ring: queries walk one index newest-first and stop
+    after ``limit`` hits or at the first alert older than ``since``.
+    """
+
+    def __init__(self, capacity=ALERT_STORE_SIZE):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._records = deque()   # (epoch seconds, alert)
+        self._by_camera = {}
+        self._by_type = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, camera_id, alerts):
+        now = time.time()
+        with self._lock:
+            for alert in alerts:
+                record = (now, dict(alert, camera_id=camera_id))
+                self._records.append(record)
+                self._by_camera.setdefault(camera_id, deque()).append(record)
+                self._by_type.setdefault(alert["type"], deque()).append(record)
+                if len(self._records) > self.capacity:
+                    self._evict()
+
+    def _evict(self):
+        _, alert = self._records.popleft()
+        # The oldest alert overall is also the oldest in each of its indexes
+        for index, key in ((self._by_camera, alert["camera_id"]), (self._by_type, alert["type"])):
+            bucket = index[key]
+            bucket.popleft()
+            if not bucket:
+                del index[key]
+
+    def query(self, camera=None, alert_type=None, since=None, limit=None):
+        """Return matching alerts newest first; ``since`` is epoch seconds."""
+        with self._lock:
+            candidates = [self._records]
+            if camera is not None:
+                candidates.append(self._by_camera.get(camera, ()))
+            if alert_type is not None:
+                candidates.append(self._by_type.get(alert_type, ()))
+            records = min(candidates, key=len)
+
+            result = []
+            for stamp, alert in reversed(records):
+                if since is not None and stamp < since:
+                    break
+                if camera is not None and alert["camera_id"] != camera:
+                    continue
+                if alert_type is not None and alert["type"] != alert_type:
+                    continue
+                result.append(alert)
+                if limit and len(result) >= limit:
+                    break
+        return result
+
+
+alert_store = AlertStore()
+
+
+# ------------- Alert Manager -------------
+class AlertManager:
+    """Per-camera, per-type cooldown in front of the alert dispatcher.
+
+    One instance is shared by all camera workers; cooldown keys are dropped
+    once they expire, so the table only holds alerts from the last
+    ``cooldown`` seconds.
+    """
+
+    def __init__(self, cooldown=ALERT_COOLDOWN):
+        self.active_alerts = {}
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    def _can_alert(self, cam_id, alert_type):
+        key = f"{cam_id}_{alert_type}"
+        now = time.time()
+        with self._lock:
+            # Keys are kept in the order they last fired, oldest first
+            expired = []
+            for old_key, last in self.active_alerts.items():
+                if now - last < self.cooldown:
+                    break
+                expired.append(old_key)
+            for old_key in expired:
+                del self.active_alerts[old_key]
+
+            if key in self.active_alerts:
+                return False
+            self.active_alerts[key] = now
+            return True
+
+    def send_alert(self, camera_id, alert_type, confidence, frame=None, track_id=None, box=None):
+        """Queue an alert for delivery; never blocks on disk or network I/O.
+
+        Alerts for a tracked face skip the cooldown, since the tracker
+        already raises each alert type once per track. ``box`` is the face
+        the evidence image is cropped to.
+        """
+        if track_id is None and not self._can_alert(camera_id, alert_type):
+            return False
+
+        current_time = datetime.now()
+        # Two tracks can alert within the same second, so the ID needs more than the time
+        alert_id = f"alert_{camera_id}_{current_time.strftime('%Y%m%d%H%M%S%f')}_{uuid.uuid4().hex[:6]}"
+        image_path = thumbnail_path = None
+        if frame is not None:
+            image_path, thumbnail_path = evidence_store.capture(camera_id, alert_id, frame, box)
+
+        # Prepare alert data for Node.js API
+        alert_data = {
+            "type": alert_type,
+            "severity": "high" if alert_type in ["with mask", "with helmet"] else "medium",
+            "description": f"Detected: {alert_type} with {confidence*100:.1f}% confidence",
+            "cameraId": camera_id,
+            "confidence": float(confidence * 100),  # Convert to percentage
+            "imagePath": image_path,
+            "thumbnailPath": thumbnail_path
+        }
+
+        return alert_dispatcher.enqueue(alert_data)
+
+
+alert_manager = AlertManager()
+
+
+# ------------- Utility Functions -------------
+face_batches = threading.local()
+
+
+def face_batch(size):
+    """A view of ``size`` slots in this thread's reusable uint8 face buffer."""
+    buffer = getattr(face_batches, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        capacity = max(size, 2 * len(buffer) if buffer is not None else 4)
+        buffer = face_batches.buffer = np.empty((capacity, IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+    return buffer[:size]
+
+
+def preprocess_face(face_bgr, out=None):
+    """Resize a BGR face crop to the model input, writing into ``out`` if given.
+
+    Channel order and scaling are left to the inference backend.
+    """
+    if out is None:
+        out = np.empty((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+    cv2.resize(face_bgr, (IMG_SIZE, IMG_SIZE), dst=out)
+    return out
+
+def draw_box_and_label(frame, x, y, w, h, label, conf):
+    color_map = {
+        "with mask": (0, 0, 255),
+        "with helmet": (0, 165, 255),
+        "normal face": (0, 255, 0)
+    }
+    color = color_map.get(label, (255, 255, 255))
+    cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+    text = f"{label} {conf*100:.1f}%"
+    cv2.putText(frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+def get_camera_source(camera_id):
+    camera = camera_registry.get(camera_id)
+    if camera and "streamUrl" in camera:
+        return camera["streamUrl"]
+    return None
+
+
+# ------------- Face Tracking -------------
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+class FaceTrack:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.probs = None
+        self.classified_box = None
+        self.frames_since_classified = 0
+        self.missed = 0
+        self.alerted = set()
+
+    @property
+    def label(self):
+        return CLASSES[int(np.argmax(self.probs))]
+
+    @property
+    def confidence(self):
+        return float(np.max(self.probs))
+
+    def needs_classification(self):
+        return (self.probs is None
+                or self.frames_since_classified >= TRACK_RECLASSIFY_EVERY
+                or box_iou(self.box, self.classified_box) < TRACK_RECLASSIFY_IOU)
+
+    def observe(self, preds):
+        preds = np.asarray(preds, dtype=np.float32)
+        if self.probs is None:
+            self.probs = preds
+        else:
+            self.probs = TRACK_SMOOTHING * self.probs + (1 - TRACK_SMOOTHING) * preds
+        self.classified_box = self.box
+        self.frames_since_classified = 0
+
+
+class FaceTracker:
+    """Greedy IoU tracker giving detected faces persistent track IDs."""
+
+    def __init__(self):
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes):
+        """Match this frame's boxes to tracks and return the tracks seen."""
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        pairs = sorted(
+            ((box_iou(track.box, box), t, b)
+             for t, track in enumerate(self.tracks)
+             for b, box in enumerate(boxes)),
+            reverse=True
+        )
+
+        matched_tracks, matched_boxes = set(), {}
+        for iou, t, b in pairs:
+            if iou < TRACK_IOU_THRESHOLD:
+                break
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes[b] = self.tracks[t]
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.missed += 1
+
+        seen = []
+        for b, box in enumerate(boxes):
+            track = matched_boxes.get(b)
+            if track is None:
+                track = FaceTrack(next(self._ids), box)
+                self.tracks.append(track)
+            else:
+                track.box = box
+                track.missed = 0
+                track.frames_since_classified += 1
+            seen.append(track)
+
+        self.tracks = [track for track in self.tracks if track.missed <= TRACK_MAX_MISSED]
+        return seen
+
+
+# ------------- Motion Gate -------------
+class MotionGate:
+    """Cheap motion check on a downscaled frame placed in front of detection.
+
+    ``sensitivity`` runs from 0 (only large changes count) to 1 (any
+    changed pixel counts).
+    """
+
+    def __init__(self, sensitivity=MOTION_SENSITIVITY, method=MOTION_METHOD):
+        self.min_area = (1.0 - min(max(sensitivity, 0.0), 1.0)) * MOTION_MAX_AREA
+        self.method = method
+        self._subtractor = None
+        if method == "mog2":
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=300, varThreshold=25, detectShadows=False
+            )
+        self._previous = None
+        self._last_motion = 0.0
+
+    def _small_gray(self, frame):
+        h, w = frame.shape[:2]
+        scale = MOTION_FRAME_WIDTH / float(w)
+        small = cv2.resize(frame, (MOTION_FRAME_WIDTH, max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def _changed_fraction(self, gray):
+        if self._subtractor is not None:
+            mask = self._subtractor.apply(gray)
+        else:
+            if self._previous is None:
+                self._previous = gray
+                return 1.0
+            mask = cv2.threshold(cv2.absdiff(gray, self._previous), 25, 255, cv2.THRESH_BINARY)[1]
+            self._previous = gray
+        return cv2.countNonZero(mask) / float(mask.size)
+
+    def update(self, frame):
+        """Feed a frame and return True while detection should run."""
+        now = time.monotonic()
+        if self._changed_fraction(self._small_gray(frame)) > self.min_area:
+            self._last_motion = now
+        return now - self._last_motion <= MOTION_HOLD_SECONDS
+
+
+# ------------- Camera Processing -------------
+class CameraRegistry:
+    """Cameras pushed by the Node API, indexed by ID in push order."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cameras = {}
+
+    def __len__(self):
+        return len(self._cameras)
+
+    def get(self, camera_id):
+        return self._cameras.get(camera_id)
+
+    def all(self):
+        with self._lock:
+            return list(self._cameras.values())
+
+    def update(self, cameras):
+        """Replace the camera list, returning the (added, changed, removed) IDs."""
+        incoming = {camera["_id"]: camera for camera in cameras}
+        with self._lock:
+            previous = self._cameras
+            self._cameras = incoming
+        added = [cam_id for cam_id in incoming if cam_id not in previous]
+        changed = [cam_id for cam_id, camera in incoming.items()
+                   if cam_id in previous and previous[cam_id] != camera]
+        removed = [cam_id for cam_id in previous if cam_id not in incoming]
+        return added, changed, removed
+
+
+camera_registry = CameraRegistry()
+camera_open_slots = threading.BoundedSemaphore(CAMERA_OPEN_CONCURRENCY)
+
+
+def open_capture(stream_url):
+    if stream_url == "0":
+        return cv2.VideoCapture(0)
+
+    if "://" in stream_url:
+        # Timeouts only take effect when passed to the constructor, which opens
+        # the stream; set afterwards, a hanging open would hold its slot forever
+        return cv2.VideoCapture(stream_url, cv2.CAP_FFMPEG, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(CAPTURE_OPEN_TIMEOUT * 1000),
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(CAPTURE_READ_TIMEOUT * 1000),
+        ])
+
+    return cv2.VideoCapture(stream_url)
+
+
+def is_live_source(stream_url):
+    return stream_url == "0" or "://" in stream_url
+
+
+class FrameGrabber:
+    """Reader thread that keeps only the newest frame of a live source.
+
+    The reader drains the source with ``grab()`` and only decodes a frame
+    with ``retrieve()`` when processing is waiting for one, so a slow
+    detector lowers the analysed frame rate instead of letting the capture
+    buffer fall behind real time, and frames nobody takes are never
+    decoded. Frames grabbed while nobody waits, or older than
+    CAPTURE_LATENCY_BUDGET when taken, count as ``frames_skipped``.
+    """
+
+    def __init__(self, cap, camera_id):
+        self.cap = cap
+        self.camera_id = camera_id
+        self._cond = threading.Condition()
+        self._frame = None
+        self._captured = None
+        self._fresh = False
+        self._waiting = 0
+        self._done = False
+        self._exited = False
+        self._abandoned = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"grab-{camera_id}", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def close(self, timeout=CAPTURE_STALL_TIMEOUT):
+        """Stop the reader and release the capture; False if the reader is stuck.
+
+        The capture may only be released once the reader is out of grab(). A
+        reader still blocked there after ``timeout`` releases it itself when
+        the read finally fails, so the camera can reconnect meanwhile.
+        """
+        self.stop()
+        self._thread.join(timeout)
+        with self._cond:
+            if not self._exited:
+                self._abandoned = True
+                return False
+        self.cap.release()
+        return True
+
+    def read(self, timeout=CAPTURE_STALL_TIMEOUT):
+        """Return (success, frame, monotonic capture time) for the newest frame."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if not self._cond.wait_for(lambda: self._fresh or self._done, remaining):
+                        return False, None, None
+                    if not self._fresh:
+                        return False, None, None
+                    self._fresh = False
+                    if time.monotonic() - self._captured <= CAPTURE_LATENCY_BUDGET:
+                        return True, self._frame, self._captured
+                    metrics.inc("frames_skipped", self.camera_id)
+            finally:
+                self._waiting -= 1
+
+    def _run(self):
+        while not self._done:
+            start = time.perf_counter()
+            if not self.cap.grab():
+                break
+            captured = time.monotonic()
+            with self._cond:
+                wanted = self._waiting > 0 and not self._fresh
+            if not wanted:
+                # Nobody is waiting: drop the frame before paying for its decode
+                metrics.inc("frames_skipped", self.camera_id)
+                continue
+
+            ok, frame = self.cap.retrieve()
+            if not ok:
+                break
+            metrics.observe("capture", time.perf_counter() - start, self.camera_id)
+            with self._cond:
+                self._frame = frame
+                self._captured = captured
+                self._fresh = True
+                self._cond.notify_all()
+        self.stop()
+        with self._cond:
+            self._exited = True
+            abandoned = self._abandoned
+        if abandoned:
+            self.cap.release()
+
+
+def analyze_frame(camera_id, frame, alert_manager, tracker=None, detector=None, roi=None):
+    """Detect and classify faces in place, returning the alerts raised.
+
+    With a ``tracker`` only new or stale tracks go to the classifier and
+    each alert type fires once per track; without one every face is
+    classified and alerts fall back to the cooldown. Without an
+    ``alert_manager`` alert-worthy events are returned but not sent.
+    """
+    alerts = []
+    with metrics.timer("detect", camera_id):
+        faces = detect_faces(frame, detector or default_face_detector, roi)
+
+    if tracker is not None:
+        tracks = tracker.update(faces)
+    else:
+        tracks = [FaceTrack(None, box) for box in faces]
+
+    stale = [track for track in tracks if track.needs_classification()]
+    if stale:
+        with metrics.timer("preprocess", camera_id):
+            batch = face_batch(len(stale))
+            for slot, (x, y, w, h) in zip(batch, (t.box for t in stale)):
+                preprocess_face(frame[y:y+h, x:x+w], out=slot)
+        for track, face_preds in zip(stale, inference_scheduler.predict(batch)):
+            track.observe(face_preds)
+
+    annotate_start = time.perf_counter()
+    for track in tracks:
+        x, y, w, h = track.box
+        label, conf = track.label, track.confidence
+        draw_box_and_label(frame, x, y, w, h, label, conf)
+
+        # Send alert if confidence is high and not a normal face
+        if conf >= CONFIDENCE_THRESHOLD and label != "normal face" and label not in track.alerted:
+            track.alerted.add(label)
+            if alert_manager is None or alert_manager.send_alert(
+                    camera_id, label, conf, frame=frame, track_id=track.track_id, box=track.box):
+                alerts.append({
+                    "type": label,
+                    "confidence": conf,
+                    "track_id": track.track_id,
+                    "timestamp": datetime.now().isoformat()
+                })
 
+    metrics.observe("annotate", time.perf_counter() - annotate_start, camera_id)
+    return alerts
 
-app = Flask(__name__)
-CORS(app)
 
+def encode_history_frame(frame):
+    """JPEG bytes kept in a camera's snapshot history, or None if encoding failed."""
+    ok, buffer = cv2.imencode('.jpg', frame)
+    return buffer.tobytes() if ok else None
 
-# ------------- Global Variables -------------
-active_alerts = [] 
-camera_status = {}
 
+def decode_history_record(record):
+    frame_time, jpeg, alerts = record
+    return frame_time, cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR), alerts
 
-# ------------- Load Face Recognition Model -------------
-custom_objects = {"Rescaling": Rescaling}
-MODEL_PATHS = ["face_model_finetuned.h5", "face_model.h5"]
-model = None
 
-for path in MODEL_PATHS:
-    if os.path.exists(path):
-        try:
-            model = tf.keras.models.load_model(path, custom_objects=custom_objects)
-            print(f"[INFO] Loaded model: {path}")
-            break
-        except Exception as e:
-            print(f"[WARNING] Failed loading {path}: {e}")
+def select_history(records, last=None, decode=True):
+    """The newest ``last`` of a camera's (time, jpeg, alerts) records, newest first."""
+    if last is not None and last < 1:
+        raise ValueError("last must be at least 1")
+    records = records[::-1][:last]
+    return [decode_history_record(record) for record in records] if decode else records
 
-if model is None:
-    print("[ERROR] No model found. Train and save a model first.")
-    sys.exit(1)
 
+def closest_history(records, when, decode=True):
+    if not records:
+        return None
+    record = min(records, key=lambda rec: abs((rec[0] - when).total_seconds()))
+    return decode_history_record(record) if decode else record
 
 
-# ------------- Face Detector -------------
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+class CameraWorker:
+    """Single capture, detect and classify loop for one camera.
 
+    Streams, snapshots and alerts all read the latest annotated frame
+    published here, so the cost per camera does not grow with viewers.
+    """
 
-# ------------- Alert Manager -------------
-class AlertManager:
-    def __init__(self, cooldown=ALERT_COOLDOWN):
-        self.active_alerts = {}
-        self.cooldown = cooldown
-        os.makedirs("alert_images", exist_ok=True)
+    def __init__(self, camera_id, stream_url, motion_sensitivity=MOTION_SENSITIVITY,
+                 detector=FACE_DETECTOR, roi=None):
+        self.camera_id = camera_id
+        self.stream_url = stream_url
+        self.config = {
+            "stream_url": stream_url,
+            "motion_sensitivity": motion_sensitivity,
+            "detector": detector,
+            "roi": roi,
+        }
+        self.alert_manager = alert_manager
+        self.tracker = FaceTracker()
+        self.detector = create_face_detector(detector)
+        self.roi = RegionOfInterest(roi) if roi else None
+        self.motion_gate = MotionGate(motion_sensitivity) if MOTION_GATE_ENABLED else None
+        self._cond = threading.Condition()
+        self._frame = None
+        self._frame_id = 0
+        self._frame_time = None
+        self._alerts = []
+        self._history = deque(maxlen=FRAME_HISTORY_SIZE)
+        self._stop = threading.Event()
+        self._grabber = None
+        self.viewers = 0
+        self.streams = {}
+        self._thread = threading.Thread(
+            target=self._run, name=f"camera-{camera_id}", daemon=True
+        )
 
-    def _can_alert(self, cam_id, alert_type):
-        key = f"{cam_id}_{alert_type}"
-        now = time.time()
-        last = self.active_alerts.get(key, 0)
-        if now - last < self.cooldown:
-            return False
-        self.active_alerts[key] = now
-        return True
+    def start(self):
+        self._thread.start()
+        return self
 
-    # -------- UPDATED HERE (Node.js API Integration) --------
-    def send_alert(self, camera_id, alert_type, confidence, frame=None):
-        if not self._can_alert(camera_id, alert_type):
-            return False
+    def stop(self):
+        self._stop.set()
+        if self._grabber is not None:
+            self._grabber.stop()
+        with self._cond:
+            self._cond.notify_all()
 
-        current_time = datetime.now()
+    def is_alive(self):
+        return self._thread.is_alive() and not self._stop.is_set()
 
-        # Save image first
-        alert_id = f"alert_{camera_id}_{current_time.strftime('%Y%m%d%H%M%S')}"
-        image_path = None
+    def latest(self):
+        with self._cond:
+            return self._frame, self._frame_id, list(self._alerts), self._frame_time
 
-        if frame is not None:
-            filename = f"{alert_id}.jpg"
-            path = os.path.join("alert_images", filename)
+    def history(self, last=None, decode=True):
+        """Return up to ``last`` recent (time, frame, alerts) records, newest first.
+
+        With ``decode=False`` records hold the stored JPEG bytes instead.
+        """
+        with self._cond:
+            records = list(self._history)
+        return select_history(records, last, decode)
+
+    def frame_at(self, when, decode=True):
+        """Return the buffered record closest to ``when``, or None."""
+        with self._cond:
+            records = list(self._history)
+        return closest_history(records, when, decode)
+
+    def wait_for_frame(self, last_id, timeout=FRAME_WAIT_TIMEOUT):
+        """Block until a frame newer than ``last_id`` is published."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._frame_id != last_id or not self.is_alive(),
+                timeout=timeout
+            )
+            if self._frame_id == last_id:
+                return None, last_id
+            return self._frame, self._frame_id
+
+    def _set_status(self, status):
+        if self.camera_id in camera_status:
+            camera_status[self.camera_id]["status"] = status
+
+    def _publish(self, frame, alerts):
+        now = datetime.now()
+        # Only this thread appends to the history, so it can be checked unlocked
+        last_kept = self._history[-1][0] if self._history else None
+        kept = (alerts or last_kept is None
+                or (now - last_kept).total_seconds() >= FRAME_HISTORY_INTERVAL)
+        # Kept frames are stored encoded: a raw 1080p frame is about 6 MB
+        jpeg = encode_history_frame(frame) if kept else None
+
+        with self._cond:
+            self._frame = frame
+            self._frame_id += 1
+            self._frame_time = now
+            self._alerts = alerts
+            if jpeg is not None:
+                self._history.append((now, jpeg, alerts))
+            frame_id = self._frame_id
+            self._cond.notify_all()
+
+        self._published(frame, frame_id, now, alerts, jpeg)
+
+        if self.camera_id in camera_status:
+            camera_status[self.camera_id]["last_frame"] = now.isoformat()
+        if alerts:
+            alert_store.add(self.camera_id, alerts)
+
+    def _published(self, frame, frame_id, frame_time, alerts, jpeg):
+        """Hook for subclasses that mirror frames elsewhere; ``jpeg`` is set for history frames."""
+
+    def process_frame(self, frame):
+        """Run one captured frame through the gate, detection and publishing."""
+        # Faces already being tracked keep detection on for people standing still
+        moving = self.motion_gate is None or self.motion_gate.update(frame)
+        # Until a model is ready, frames are streamed without classification
+        if model_registry.ready and (moving or self.tracker.tracks):
             try:
-                cv2.imwrite(path, frame)
-                image_path = path
-                print(f"[INFO] Alert image saved: {filename}")
+                alerts = analyze_frame(self.camera_id, frame, self.alert_manager,
+                                       self.tracker, self.detector, self.roi)
             except Exception as e:
-                print(f"[WARNING] Failed to save alert image: {e}")
+                # A failed model call costs this frame its labels, not the camera its worker;
+                # unclassified tracks are retried on the next frame
+                alerts = []
+                metrics.inc("inference_errors", self.camera_id)
+                print(f"[ERROR] Frame analysis failed for {self.camera_id}: {e}")
+        else:
+            alerts = []
+            metrics.inc("frames_idle", self.camera_id)
+        self._publish(frame, alerts)
+        metrics.inc("frames", self.camera_id)
+        metrics.tick(self.camera_id)
+        return alerts
 
-        # Prepare alert data for Node.js API
-        alert_data = {
-            "type": alert_type,
-            "severity": "high" if alert_type in ["with mask", "with helmet"] else "medium",
-            "description": f"Detected: {alert_type} with {confidence*100:.1f}% confidence",
-            "cameraId": camera_id,
-            "confidence": float(confidence * 100),  # Convert to percentage
-            "imagePath": image_path
-        }
+    def _capture(self, cap):
+        """Process frames until the source fails, then release it; True if any frame was read."""
+        if CAPTURE_LATEST_ONLY and is_live_source(self.stream_url):
+            self._grabber = FrameGrabber(cap, self.camera_id).start()
 
-        # Send to Node.js API
-        try:
-            response = requests.post(
-                'http://localhost:3001/api/alerts',
-                json=alert_data,
-                timeout=5
-            )
+        read_any = False
+        while not self._stop.is_set():
+            if self._grabber is not None:
+                success, frame, captured = self._grabber.read()
+            else:
+                with metrics.timer("capture", self.camera_id):
+                    success, frame = cap.read()
+                captured = time.monotonic()
+            if not success:
+                if not self._stop.is_set():
+                    metrics.inc("capture_failures", self.camera_id)
+                    print(f"[WARNING] Failed to read frame from: {self.stream_url}")
+                break
 
-            if response.status_code == 201:
-                print(f"[SUCCESS] Alert sent to API: {alert_data['type']}")
-                return True
+            read_any = True
+            self.process_frame(frame)
+            metrics.observe("latency", time.monotonic() - captured, self.camera_id)
+
+        if self._grabber is None:
+            cap.release()
+        elif not self._grabber.close():
+            print(f"[WARNING] Capture of {self.camera_id} is stuck; it is released in the background")
+        self._grabber = None
+        return read_any
+
+    def _run(self):
+        # Live streams reconnect with exponential backoff; files end the worker
+        live = is_live_source(self.stream_url)
+        delay = RECONNECT_BASE_DELAY
+
+        while not self._stop.is_set():
+            if live:
+                with camera_open_slots:
+                    cap = open_capture(self.stream_url)
             else:
-                print(f"[ERROR] Failed to send alert. Status: {response.status_code}")
-                print(f"Response: {response.text}")
-                return False
+                cap = open_capture(self.stream_url)
 
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] Failed to send alert to API: {e}")
-            return False
-    # --------------------------------------------------------
+            if cap.isOpened():
+                print(f"[INFO] Started camera worker for {self.camera_id}: {self.stream_url}")
+                self._set_status("online")
+                if self._capture(cap):
+                    delay = RECONNECT_BASE_DELAY
+            else:
+                print(f"[ERROR] Could not open camera stream: {self.stream_url}")
+                cap.release()
 
+            if self._stop.is_set():
+                break
+            self._set_status("offline")
+            if not live:
+                break
+            metrics.inc("reconnects", self.camera_id)
+            # Jitter keeps a fleet that dropped together from reconnecting in lockstep
+            wait = delay * random.uniform(0.5, 1.0)
+            print(f"[INFO] Reconnecting {self.camera_id} in {wait:.1f}s")
+            self._stop.wait(wait)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
 
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        print(f"[INFO] Stopped camera worker for {self.camera_id}")
 
-# ------------- Utility Functions -------------
-def preprocess_face(face_bgr):
-    face_rgb = cv2.cvtColor(face_bgr, cv2.COLOR_BGR2RGB)
-    face_resized = cv2.resize(face_rgb, (IMG_SIZE, IMG_SIZE))
-    arr = face_resized.astype(np.float32) / 255.0
-    return np.expand_dims(arr, axis=0)
 
-def draw_box_and_label(frame, x, y, w, h, label, conf):
-    color_map = {
-        "with mask": (0, 0, 255),
-        "with helmet": (0, 165, 255),
-        "normal face": (0, 255, 0)
+def get_camera_worker(camera_id):
+    with camera_workers_lock:
+        return camera_workers.get(camera_id)
+
+
+def camera_worker_config(camera):
+    sensitivity = camera.get("motionSensitivity")
+    roi = camera.get("roi") or None
+    if roi is not None:
+        RegionOfInterest(roi)   # raises ValueError for a malformed polygon
+    return {
+        "stream_url": camera["streamUrl"],
+        "motion_sensitivity": MOTION_SENSITIVITY if sensitivity is None else float(sensitivity),
+        "detector": camera.get("detector") or FACE_DETECTOR,
+        "roi": roi,
     }
-    color = color_map.get(label, (255, 255, 255))
-    cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-    text = f"{label} {conf*100:.1f}%"
-    cv2.putText(frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
-def get_camera_source(camera_id):
-    camera = next((cam for cam in CAMERAS if cam["_id"] == camera_id), None)
-    if camera and "streamUrl" in camera:
-        return camera["streamUrl"]
-    return None
 
+def validate_cameras(cameras):
+    """Raise ValueError naming the first camera a worker could not be built for."""
+    for camera in cameras:
+        if not isinstance(camera, dict) or "_id" not in camera:
+            raise ValueError("Every camera must be an object with an _id")
+        # IDs key dicts, pick shards and name evidence folders
+        if not isinstance(camera["_id"], str) or not camera["_id"]:
+            raise ValueError(f"Camera _id must be a non-empty string, got {camera['_id']!r}")
+        if camera.get("streamUrl"):
+            try:
+                camera_worker_config(camera)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid configuration for camera {camera['_id']}: {e}") from None
 
-# ------------- Camera Processing -------------
-def process_camera_frame(camera_id, alert_manager):
-    stream_url = get_camera_source(camera_id)
-    if not stream_url:
-        print(f"[ERROR] No stream URL found for camera: {camera_id}")
-        return None, []
-
-    cap = cv2.VideoCapture(stream_url)
-    
-    if stream_url.startswith('rtsp://'):
-        cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 10000)
-    
-    if not cap.isOpened():
-        print(f"[ERROR] Could not open camera stream: {stream_url}")
-        return None, []
-
-    ret, frame = cap.read()
-    cap.release()  
-    
-    if not ret:
-        print(f"[ERROR] Could not read frame from: {stream_url}")
-        return None, []
 
-    alerts = []
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(60, 60))
-
-    for (x, y, w, h) in faces:
-        face_roi = frame[y:y+h, x:x+w]
-        processed = preprocess_face(face_roi)
-        preds = model.predict(processed, verbose=0)
-        conf = float(np.max(preds))
-        label = CLASSES[int(np.argmax(preds))]
-        draw_box_and_label(frame, x, y, w, h, label, conf)
+def sync_camera_workers(cameras):
+    """Start workers for new cameras and stop those removed or changed."""
+    if CAMERA_PROCESSES:
+        sync_camera_shards(cameras)
+        return
 
-        if conf >= CONFIDENCE_THRESHOLD and label != "normal face":
-            if alert_manager.send_alert(camera_id, label, conf, frame=frame.copy()):
-                alerts.append({
-                    "type": label,
-                    "confidence": conf,
-                    "timestamp": datetime.now().isoformat()
-                })
+    wanted = {
+        cam["_id"]: camera_worker_config(cam)
+        for cam in cameras if cam.get("streamUrl")
+    }
 
-    return frame, alerts
+    if wanted:
+        model_registry.ensure_loading()
 
+    with camera_workers_lock:
+        for cam_id, worker in list(camera_workers.items()):
+            if wanted.get(cam_id) != worker.config or not worker.is_alive():
+                worker.stop()
+                del camera_workers[cam_id]
 
-def generate_frames(camera_id):
-    stream_url = get_camera_source(camera_id)
-    print(stream_url)
-    if not stream_url:
-        print(f"[ERROR] No stream URL found for camera: {camera_id}")
-        return
-    if stream_url == "0":
-        stream_url = 0
-
-    cap = cv2.VideoCapture(stream_url)
-    alert_manager = AlertManager()  # Create alert manager instance
-    
-    
-    if not cap.isOpened():
-        print(f"[ERROR] Could not open camera stream: {stream_url}")
-        return
-    
-    print(f"[INFO] Started streaming from: {stream_url}")
-    
+        for cam_id, config in wanted.items():
+            if cam_id not in camera_workers:
+                camera_workers[cam_id] = camera_worker_class(cam_id, **config).start()
+
+
+# ------------- Camera Shards -------------
+class SharedFrameRing:
+    """Ring of raw BGR frames in shared memory, one writer and many readers.
+
+    Each slot carries a sequence number that is odd while the writer is
+    copying into it, so readers retry instead of taking a torn frame.
+    """
+
+    HEADER = 5  # seq, frame_id, height, width, timestamp in microseconds
+
+    def __init__(self, shm, frame_bytes):
+        self.shm = shm
+        self.name = shm.name
+        self.frame_bytes = frame_bytes
+        buf = shm.buf
+        self._control = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self._headers = np.ndarray((SHARED_FRAME_SLOTS, self.HEADER), dtype=np.int64,
+                                   buffer=buf, offset=8)
+        self._data = np.ndarray((SHARED_FRAME_SLOTS, frame_bytes), dtype=np.uint8, buffer=buf,
+                                offset=8 + SHARED_FRAME_SLOTS * self.HEADER * 8)
+
+    @classmethod
+    def size_for(cls, frame_bytes):
+        return 8 + SHARED_FRAME_SLOTS * (cls.HEADER * 8 + frame_bytes)
+
+    @classmethod
+    def create(cls, frame_bytes):
+        shm = shared_memory.SharedMemory(
+            name=f"guardai_{uuid.uuid4().hex[:16]}", create=True, size=cls.size_for(frame_bytes)
+        )
+        ring = cls(shm, frame_bytes)
+        ring._control[:] = 0
+        ring._headers[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, frame_bytes):
+        # Spawned shards share this process's resource tracker, so segments
+        # left behind by a crashed shard are still unlinked at exit.
+        return cls(shared_memory.SharedMemory(name=name), frame_bytes)
+
+    def latest_id(self):
+        return int(self._control[0])
+
+    def write(self, frame, frame_id, frame_time):
+        header = self._headers[frame_id % SHARED_FRAME_SLOTS]
+        header[0] += 1
+        self._data[frame_id % SHARED_FRAME_SLOTS, :frame.nbytes] = frame.reshape(-1)
+        header[1:] = (frame_id, frame.shape[0], frame.shape[1], int(frame_time.timestamp() * 1e6))
+        header[0] += 1
+        self._control[0] = frame_id
+
+    def read(self):
+        """Copy out the newest frame as (frame_id, frame, time), or None."""
+        for _ in range(SHARED_FRAME_SLOTS * 2):
+            frame_id = self.latest_id()
+            if frame_id == 0:
+                return None
+            slot = frame_id % SHARED_FRAME_SLOTS
+            header = self._headers[slot]
+            seq = int(header[0])
+            if seq % 2:
+                continue
+            h, w, stamp = int(header[2]), int(header[3]), int(header[4])
+            frame = self._data[slot, :h * w * 3].copy().reshape(h, w, 3)
+            if int(header[0]) == seq and int(header[1]) == frame_id:
+                return frame_id, frame, datetime.fromtimestamp(stamp / 1e6)
+        return None
+
+    def close(self, unlink=False):
+        # Views into the buffer must go before the segment can be closed
+        self._control = self._headers = self._data = None
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class ShardCameraWorker(CameraWorker):
+    """Camera worker inside a shard process.
+
+    Annotated frames go to a shared ring read by the front end; alerts,
+    sampled history frames and status go back over the shard's event queue.
+    """
+
+    def __init__(self, camera_id, stream_url, **config):
+        super().__init__(camera_id, stream_url, **config)
+        self.ring = None
+
+    def _published(self, frame, frame_id, frame_time, alerts, jpeg):
+        if self.ring is None or self.ring.frame_bytes < frame.nbytes:
+            if self.ring is not None:
+                self.ring.close(unlink=True)
+            self.ring = SharedFrameRing.create(frame.nbytes)
+            shard_events.put({"event": "attached", "camera_id": self.camera_id,
+                              "name": self.ring.name, "frame_bytes": frame.nbytes})
+        self.ring.write(frame, frame_id, frame_time)
+
+        if jpeg is not None:
+            shard_events.put({"event": "history", "camera_id": self.camera_id,
+                              "time": frame_time, "jpeg": jpeg, "alerts": alerts})
+
+    def _run(self):
+        try:
+            super()._run()
+        finally:
+            shard_events.put({"event": "detached", "camera_id": self.camera_id})
+            if self.ring is not None:
+                self.ring.close(unlink=True)
+
+
+camera_worker_class = CameraWorker
+shard_events = None
+
+
+def run_camera_shard(index, shard_count, commands, events):
+    """Entry point of a shard process: own capture and detection for its cameras."""
+    global CAMERA_PROCESSES, camera_worker_class, shard_events
+    CAMERA_PROCESSES = 0
+    camera_worker_class = ShardCameraWorker
+    shard_events = events
+    alert_dispatcher.spool_path = os.path.join(ALERT_SPOOL_DIR, f"pending_shard{index}.jsonl")
+    # Each shard indexes the evidence of its own cameras and a share of the total quota
+    evidence_store.camera_filter = lambda cam_id: zlib.crc32(cam_id.encode()) % shard_count == index
+    evidence_store.total_quota //= shard_count
+    alert_dispatcher.start()
+    evidence_store.start()
+    print(f"[INFO] Camera shard {index} started (pid {os.getpid()})")
+
+    last_status = 0.0
     while True:
-        success, frame = cap.read()
-        if not success:
-            print(f"[WARNING] Failed to read frame from: {stream_url}")
-            break
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(60, 60))
-
-        for (x, y, w, h) in faces:
-            face_roi = frame[y:y+h, x:x+w]
-            processed = preprocess_face(face_roi)
-            preds = model.predict(processed, verbose=0)
-            conf = float(np.max(preds))
-            label = CLASSES[int(np.argmax(preds))]
-            draw_box_and_label(frame, x, y, w, h, label, conf)
-            
-            # Send alert if confidence is high and not a normal face
-            if conf >= CONFIDENCE_THRESHOLD and label != "normal face":
-                alert_manager.send_alert(camera_id, label, conf, frame=frame.copy())
-
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        if not ret:
-            continue
-            
-        frame_bytes = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-
-    cap.release()
-    print(f"[INFO] Stopped streaming from: {stream_url}")
+        try:
+            command = commands.get(timeout=SHARD_STATUS_INTERVAL)
+        except queue.Empty:
+            command = None
+
+        if command is not None:
+            if command["op"] == "stop":
+                break
+            if command["op"] == "reload":
+                reply = {"event": "reply", "request_id": command.get("request_id")}
+                try:
+                    reply.update(success=True, model=model_registry.load(command["backend"], command["path"]))
+                except RuntimeError as e:
+                    reply.update(success=False, message=str(e), model=model_registry.status())
+                events.put(reply)
+                continue
+            for camera in command["cameras"]:
+                camera_status.setdefault(camera["_id"], {"status": "online", "last_frame": None})
+            sync_camera_workers(command["cameras"])
+
+        if time.monotonic() - last_status >= SHARD_STATUS_INTERVAL:
+            last_status = time.monotonic()
+            with camera_workers_lock:
+                cam_ids = list(camera_workers)
+            for cam_id in cam_ids:
+                events.put({"event": "status", "camera_id": cam_id,
+                            "status": camera_status.get(cam_id, {}),
+                            "summary": metrics.camera_summary(cam_id)})
+            events.put({"event": "metrics", "metrics": metrics.snapshot(),
+                        "model": model_registry.status()})
+
+    sync_camera_workers([])
+
+
+class RemoteCameraView:
+    """Front-end stand-in for a CameraWorker running in a shard process.
+
+    Offers the same read interface (latest, wait_for_frame, history,
+    frame_at) backed by the shard's shared frame ring.
+    """
+
+    def __init__(self, camera_id, shard):
+        self.camera_id = camera_id
+        self.shard = shard
+        self.ring = None
+        self.viewers = 0
+        self.streams = {}
+        self.summary = {}
+        self._alive = True
+        self._cond = threading.Condition()
+        self._read_lock = threading.Lock()
+        self._frame_id = 0
+        self._cached = (0, None, None)
+        self._alerts = []
+        self._history = deque(maxlen=FRAME_HISTORY_SIZE)
+
+    def attach(self, name, frame_bytes):
+        with self._read_lock:
+            if self.ring is not None:
+                self.ring.close()
+            self.ring = SharedFrameRing.attach(name, frame_bytes)
+
+    def poll(self):
+        ring = self.ring
+        frame_id = ring.latest_id() if ring is not None else 0
+        if frame_id != self._frame_id:
+            with self._cond:
+                self._frame_id = frame_id
+                self._cond.notify_all()
+
+    def add_history(self, frame_time, jpeg, alerts):
+        self._alerts = alerts
+        self._history.append((frame_time, jpeg, alerts))
+
+    def is_alive(self):
+        return self._alive and self.shard.is_alive()
+
+    def close(self, unlink=False):
+        self._alive = False
+        with self._cond:
+            self._cond.notify_all()
+        with self._read_lock:
+            if self.ring is not None:
+                self.ring.close(unlink=unlink)
+                self.ring = None
+
+    def _read(self):
+        with self._read_lock:
+            if self.ring is None:
+                return self._cached
+            if self._cached[0] != self.ring.latest_id():
+                self._cached = self.ring.read() or self._cached
+            return self._cached
+
+    def latest(self):
+        frame_id, frame, frame_time = self._read()
+        return frame, frame_id, list(self._alerts), frame_time
+
+    def wait_for_frame(self, last_id, timeout=FRAME_WAIT_TIMEOUT):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._frame_id != last_id or not self.is_alive(),
+                timeout=timeout
+            )
+            if self._frame_id == last_id:
+                return None, last_id
+        frame_id, frame, _ = self._read()
+        return frame, frame_id
+
+    def history(self, last=None, decode=True):
+        return select_history(list(self._history), last, decode)
+
+    def frame_at(self, when, decode=True):
+        return closest_history(list(self._history), when, decode)
+
+
+class CameraShard:
+    """Supervises one shard process and relays its frames and events.
+
+    A crashed shard only takes its own cameras offline; it is restarted
+    with the same cameras after SHARD_RESTART_DELAY.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.cameras = []
+        self.views = {}
+        self.metrics = None   # latest PipelineMetrics.snapshot() from the process
+        self.model = {}       # latest ModelRegistry.status() from the process
+        self._replies = {}    # request id -> [Event, reply]
+        self._ctx = multiprocessing.get_context("spawn")
+        self._start_process()
+        threading.Thread(target=self._monitor, name=f"shard-{index}", daemon=True).start()
+
+    def _start_process(self):
+        self.commands = self._ctx.Queue()
+        self.events = self._ctx.Queue()
+        self.process = self._ctx.Process(
+            target=run_camera_shard,
+            args=(self.index, CAMERA_PROCESSES, self.commands, self.events),
+            name=f"camera-shard-{self.index}", daemon=True
+        )
+        self.process.start()
+        if shard_model is not None:
+            # A restarted shard comes back on the model last swapped in, not the default
+            self.commands.put(dict(shard_model, op="reload"))
+        if self.cameras:
+            self.commands.put({"op": "sync", "cameras": self.cameras})
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def sync(self, cameras):
+        self.cameras = cameras
+        self.commands.put({"op": "sync", "cameras": cameras})
+
+    def send_request(self, command):
+        """Queue a command that the shard answers with a reply event; returns its ID."""
+        request_id = uuid.uuid4().hex
+        self._replies[request_id] = [threading.Event(), None]
+        self.commands.put(dict(command, request_id=request_id))
+        return request_id
+
+    def wait_reply(self, request_id, timeout):
+        done, _ = self._replies[request_id]
+        done.wait(timeout)
+        reply = self._replies.pop(request_id)[1]
+        if reply is None:
+            return {"success": False, "message": f"Shard {self.index} did not reply in time"}
+        return reply
+
+    def _handle(self, event):
+        kind = event["event"]
+        if kind == "reply":
+            waiting = self._replies.get(event["request_id"])
+            if waiting is not None:
+                waiting[1] = {key: value for key, value in event.items()
+                              if key not in ("event", "request_id")}
+                waiting[0].set()
+            return
+        if kind == "metrics":
+            self.metrics = event["metrics"]
+            self.model = event["model"]
+            return
+
+        cam_id = event["camera_id"]
+        if kind == "attached":
+            view = self.views.get(cam_id)
+            if view is None:
+                view = self.views[cam_id] = RemoteCameraView(cam_id, self)
+                with camera_workers_lock:
+                    camera_workers[cam_id] = view
+            view.attach(event["name"], event["frame_bytes"])
+        elif kind == "detached":
+            view = self.views.pop(cam_id, None)
+            if view is not None:
+                with camera_workers_lock:
+                    if camera_workers.get(cam_id) is view:
+                        del camera_workers[cam_id]
+                view.close()
+        elif kind == "history":
+            view = self.views.get(cam_id)
+            if view is not None:
+                view.add_history(event["time"], event["jpeg"], event["alerts"])
+            if event["alerts"]:
+                alert_store.add(cam_id, event["alerts"])
+        elif kind == "status":
+            if cam_id in camera_status:
+                camera_status[cam_id].update(event["status"])
+            view = self.views.get(cam_id)
+            if view is not None:
+                view.summary = event["summary"]
+
+    def _crashed(self):
+        print(f"[ERROR] Camera shard {self.index} exited with code {self.process.exitcode}; "
+              f"{len(self.views)} camera(s) offline")
+        for cam_id, view in self.views.items():
+            with camera_workers_lock:
+                if camera_workers.get(cam_id) is view:
+                    del camera_workers[cam_id]
+            # The shard can no longer clean up its own segments
+            view.close(unlink=True)
+            if cam_id in camera_status:
+                camera_status[cam_id]["status"] = "offline"
+        self.views = {}
+        self.metrics = None
+        self.model = {}
+        time.sleep(SHARD_RESTART_DELAY)
+        print(f"[INFO] Restarting camera shard {self.index}")
+        self._start_process()
+
+    def _monitor(self):
+        while True:
+            try:
+                while True:
+                    self._handle(self.events.get_nowait())
+            except queue.Empty:
+                pass
+
+            for view in list(self.views.values()):
+                view.poll()
+
+            if not self.process.is_alive():
+                self._crashed()
+            time.sleep(SHARED_POLL_INTERVAL)
+
+
+camera_shards = []
+shard_model = None   # {"backend", "path"} last reloaded into the shards
+
+
+def reload_shard_models(backend, path):
+    """Swap the model in every shard process, returning each shard's reply."""
+    global shard_model
+    shard_model = {"backend": backend, "path": path}
+    # Shards load in parallel; each keeps serving its old model until warmed up
+    requests_sent = [(shard, shard.send_request(dict(shard_model, op="reload")))
+                     for shard in camera_shards]
+    deadline = time.monotonic() + SHARD_RELOAD_TIMEOUT
+    return [dict(shard.wait_reply(request_id, max(0.0, deadline - time.monotonic())),
+                 shard=shard.index)
+            for shard, request_id in requests_sent]
+
+
+def sync_camera_shards(cameras):
+    """Route each camera to a shard process by a stable hash of its ID."""
+    if not camera_shards:
+        camera_shards.extend(CameraShard(i) for i in range(CAMERA_PROCESSES))
+
+    assigned = [[] for _ in camera_shards]
+    for camera in cameras:
+        shard = zlib.crc32(camera["_id"].encode()) % len(camera_shards)
+        assigned[shard].append(camera)
+
+    for shard, shard_cameras in zip(camera_shards, assigned):
+        if shard_cameras != shard.cameras:
+            shard.sync(shard_cameras)
+
+
+def encode_jpeg(frame, profile=DEFAULT_STREAM_PROFILE):
+    """Encode a frame at a stream profile's width and quality, or None on failure."""
+    settings = STREAM_PROFILES[profile]
+    width = settings["width"]
+    if width and frame.shape[1] > width:
+        height = round(frame.shape[0] * width / frame.shape[1])
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, settings["quality"]])
+    return buffer.tobytes() if ok else None
+
+
+class EncodedStream:
+    """JPEG frames of one camera at one output profile, shared by its viewers.
+
+    The encoder thread only runs while the profile has viewers, so tiers
+    nobody watches cost nothing.
+    """
+
+    def __init__(self, worker, profile):
+        self.worker = worker
+        self.profile = profile
+        self.settings = STREAM_PROFILES[profile]
+        self.clients = 0
+        self._cond = threading.Condition()
+        self._jpeg = None
+        self._jpeg_id = 0
+        self._thread = None
+
+    def attach(self):
+        with self._cond:
+            self.clients += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"encode-{self.worker.camera_id}-{self.profile}",
+                    daemon=True
+                )
+                self._thread.start()
+
+    def detach(self):
+        with self._cond:
+            self.clients -= 1
+
+    def wait(self, last_id, timeout=FRAME_WAIT_TIMEOUT):
+        """Block until JPEG bytes newer than ``last_id`` are encoded."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._jpeg_id != last_id or self._thread is None, timeout=timeout
+            )
+            if self._jpeg_id == last_id:
+                return None, last_id
+            return self._jpeg, self._jpeg_id
+
+    def _run(self):
+        camera_id = self.worker.camera_id
+        interval = 1.0 / self.settings["fps"] if self.settings["fps"] else 0.0
+        last_id = 0
+        next_time = 0.0
+
+        while True:
+            with self._cond:
+                if not self.clients or not self.worker.is_alive():
+                    self._thread = None
+                    self._cond.notify_all()
+                    return
+
+            # Rate-limited tiers sleep and then take whatever frame is newest
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            frame, frame_id = self.worker.wait_for_frame(last_id)
+            if frame is None:
+                continue
+            last_id = frame_id
+            next_time = time.monotonic() + interval
+
+            with metrics.timer("encode", camera_id):
+                jpeg = encode_jpeg(frame, self.profile)
+            if jpeg is None:
+                continue
+            with self._cond:
+                self._jpeg = jpeg
+                self._jpeg_id += 1
+                self._cond.notify_all()
+
+
+encoded_streams_lock = threading.Lock()
+
+
+def get_encoded_stream(worker, profile):
+    with encoded_streams_lock:
+        stream = worker.streams.get(profile)
+        if stream is None:
+            stream = worker.streams[profile] = EncodedStream(worker, profile)
+        return stream
+
+
+def generate_frames(camera_id, profile=DEFAULT_STREAM_PROFILE):
+    worker = get_camera_worker(camera_id)
+    if worker is None:
+        print(f"[ERROR] No camera worker running for camera: {camera_id}")
+        return
+
+    print(f"[INFO] Viewer attached to camera: {camera_id} ({profile})")
+    stream = get_encoded_stream(worker, profile)
+    worker.viewers += 1
+    stream.attach()
+    last_id = 0
+
+    try:
+        while True:
+            frame_bytes, jpeg_id = stream.wait(last_id)
+            if frame_bytes is None:
+                if not worker.is_alive():
+                    break
+                continue
+            if last_id and jpeg_id - last_id > 1:
+                # Frames encoded while this viewer was still sending
+                metrics.inc("frames_dropped", camera_id, jpeg_id - last_id - 1)
+            last_id = jpeg_id
+
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    finally:
+        stream.detach()
+        worker.viewers -= 1
+        print(f"[INFO] Viewer detached from camera: {camera_id} ({profile})")
 
 
 # ------------- Flask Routes -------------
@@ -256,90 +2449,431 @@ def index():
 
 @app.route('/api/all-cameras', methods=['POST'])
 def receive_all_cameras():
-    global CAMERAS, camera_status
     try:
         data = request.get_json()
 
         if not isinstance(data, list):
             return jsonify({"success": False, "message": "Invalid data format. Expected a list."}), 400
 
-        CAMERAS = data 
-        
-        for camera in CAMERAS:
-            cam_id = camera["_id"]
+        # Reject the whole push before anything is committed, so a bad camera
+        # cannot leave the registry ahead of the running workers
+        try:
+            validate_cameras(data)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
+        added, changed, removed = camera_registry.update(data)
+
+        for cam_id in removed:
+            camera_status.pop(cam_id, None)
+        for cam_id in added + changed:
+            camera = camera_registry.get(cam_id)
+            previous = camera_status.get(cam_id, {})
             camera_status[cam_id] = {
-                "status": "online", 
-                "last_frame": None, 
-                "alerts": [],
+                "status": previous.get("status", "online"), 
+                "last_frame": previous.get("last_frame"), 
+                "alerts": previous.get("alerts", []),
                 "streamUrl": camera.get("streamUrl", "")
             }
 
-        print(f"[INFO] Updated camera list with {len(CAMERAS)} cameras")
-        for cam in CAMERAS:
-            print(f"  - {cam['_id']}: {cam.get('streamUrl', 'No stream URL')}")
+        # Unchanged cameras keep their workers; only dead ones are restarted
+        sync_camera_workers(camera_registry.all())
+
+        print(f"[INFO] Updated camera list with {len(camera_registry)} cameras "
+              f"({len(added)} added, {len(changed)} changed, {len(removed)} removed)")
+        for cam_id in added + changed:
+            print(f"  - {cam_id}: {camera_registry.get(cam_id).get('streamUrl', 'No stream URL')}")
 
         return jsonify({
             "success": True,
             "message": "Camera data updated successfully",
-            "total_cameras": len(CAMERAS)
+            "total_cameras": len(camera_registry),
+            "added": len(added),
+            "changed": len(changed),
+            "removed": len(removed)
         })
 
     except Exception as e:
         print(f"[ERROR] Failed to process camera data: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+def query_alerts(limit=None):
+    """Answer an alert query from ?camera=, ?type=, ?since= and ?limit=."""
+    since = request.args.get('since')
+    try:
+        since = parse_timestamp(since).timestamp() if since else None
+    except ValueError:
+        return jsonify({"error": f"Invalid 'since' timestamp: {since}"}), 400
+
+    return jsonify(alert_store.query(
+        camera=request.args.get('camera'),
+        alert_type=request.args.get('type'),
+        since=since,
+        limit=request.args.get('limit', limit, type=int)
+    ))
+
 @app.route('/api/alerts/recent')
 def get_recent_alerts():
-    recent = sorted(active_alerts, key=lambda x: x['timestamp'], reverse=True)[:10]
-    return jsonify(recent)
+    return query_alerts(limit=ALERT_RECENT_LIMIT)
 
 @app.route('/api/alerts/all')
 def get_all_alerts():
-    return jsonify(active_alerts)
+    return query_alerts()
 
 @app.route('/api/cameras/status')
 def get_camera_status():
-    return jsonify(camera_status)
+    status = {}
+    for cam_id, info in camera_status.items():
+        worker = get_camera_worker(cam_id)
+        summary = metrics.camera_summary(cam_id)
+        if isinstance(worker, RemoteCameraView) and worker.summary:
+            # Capture and detection stages are measured in the shard process
+            summary["fps"] = worker.summary["fps"]
+            summary["counters"] = dict(worker.summary["counters"], **summary["counters"])
+            summary["stages"] = dict(worker.summary["stages"], **summary["stages"])
+        status[cam_id] = dict(
+            info,
+            viewers=worker.viewers if worker else 0,
+            streams={name: stream.clients for name, stream in worker.streams.items()
+                     if stream.clients} if worker else {},
+            **summary
+        )
+    return jsonify(status)
+
+@app.route('/metrics')
+def get_metrics():
+    # Capture, detection and inference run in the shard processes when sharded
+    remote = [shard.metrics for shard in camera_shards if shard.metrics]
+    return Response(metrics.render_prometheus(remote), mimetype='text/plain; version=0.0.4')
 
 @app.route('/video_feed/<camera_id>')
 def video_feed(camera_id):
-    return Response(generate_frames(camera_id),
+    profile = request.args.get('profile', DEFAULT_STREAM_PROFILE)
+    if profile not in STREAM_PROFILES:
+        return jsonify({
+            "error": f"Unknown stream profile: {profile}",
+            "profiles": list(STREAM_PROFILES)
+        }), 400
+    return Response(generate_frames(camera_id, profile),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
-@app.route('/api/cameras/<camera_id>/snapshot')
-def get_snapshot(camera_id):
-    alert_manager = AlertManager()
-    
-    frame, alerts = process_camera_frame(camera_id, alert_manager)
-
-    if frame is not None:
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        if camera_id in camera_status:
-            camera_status[camera_id]["last_frame"] = datetime.now().isoformat()
-        
-        return jsonify({
-            "success": True,
+def parse_timestamp(value):
+    """Accept either epoch seconds or an ISO 8601 string."""
+    try:
+        return datetime.fromtimestamp(float(value))
+    except (ValueError, OverflowError, OSError):
+        # Out-of-range epochs such as "inf" or "1e20" end up rejected here too
+        when = datetime.fromisoformat(value)
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+
+def encode_snapshot(frame_time, frame, alerts):
+    _, buffer = cv2.imencode('.jpg', frame)
+    return snapshot_json(frame_time, buffer, alerts)
+
+
+def snapshot_json(frame_time, jpeg, alerts):
+    frame_base64 = base64.b64encode(jpeg).decode('utf-8')
+    return {
+        "image": f"data:image/jpeg;base64,{frame_base64}",
+        "alerts": alerts,
+        "timestamp": frame_time.isoformat()
+    }
+
+
+def snapshot_record(camera_id, when=None):
+    """The (time, frame, alerts) record a snapshot is taken from, or None."""
+    worker = get_camera_worker(camera_id)
+    if worker is None:
+        return None
+    if when is not None:
+        return worker.frame_at(when)
+    frame, _, alerts, frame_time = worker.latest()
+    return (frame_time, frame, alerts) if frame is not None else None
+
+
+def snapshot_payload(camera_id, at=None, last=None):
+    """Build the snapshot JSON body and status code for either server."""
+    worker = get_camera_worker(camera_id)
+
+    try:
+        when = parse_timestamp(at) if at else None
+    except ValueError:
+        return {
+            "success": False,
+            "error": f"Invalid 'at' timestamp: {at}",
+            "camera_id": camera_id
+        }, 400
+
+    if last is not None and last < 1:
+        return {
+            "success": False,
+            "error": f"Invalid 'last' count: {last}",
+            "camera_id": camera_id
+        }, 400
+
+    # History frames are already JPEG: send the stored bytes as they are
+    if worker is not None and last:
+        frames = [snapshot_json(*record) for record in worker.history(last, decode=False)]
+        return {
+            "success": bool(frames),
             "camera_id": camera_id,
-            "image": f"data:image/jpeg;base64,{frame_base64}",
-            "alerts": alerts,
-            "timestamp": datetime.now().isoformat()
-        })
+            "frames": frames
+        }, 200
+
+    if worker is not None and when is not None:
+        record = worker.frame_at(when, decode=False)
+        snapshot = snapshot_json(*record) if record is not None else None
     else:
-        return jsonify({
+        record = snapshot_record(camera_id)
+        snapshot = encode_snapshot(*record) if record is not None else None
+    if snapshot is not None:
+        return dict(snapshot, success=True, camera_id=camera_id), 200
+    else:
+        return {
             "success": False, 
             "error": "Could not capture frame",
             "camera_id": camera_id
-        })
+        }, 200
+
+
+def snapshot_image(camera_id, at=None, profile=DEFAULT_STREAM_PROFILE):
+    """Build the binary snapshot as (body, content type, headers, status) for either server."""
+    def error(message, status):
+        body = json.dumps({"success": False, "error": message, "camera_id": camera_id})
+        return body.encode("utf-8"), "application/json", {}, status
+
+    if profile not in STREAM_PROFILES:
+        return error(f"Unknown stream profile: {profile}", 400)
+    try:
+        when = parse_timestamp(at) if at else None
+    except ValueError:
+        return error(f"Invalid 'at' timestamp: {at}", 400)
+
+    worker = get_camera_worker(camera_id)
+    if when is not None and worker is not None and STREAM_PROFILES[profile]["width"] is None:
+        # Full-size history frames are served as stored, without a second lossy pass
+        record = worker.frame_at(when, decode=False)
+        jpeg = record[1] if record is not None else None
+    else:
+        record = snapshot_record(camera_id, when)
+        jpeg = encode_jpeg(record[1], profile) if record is not None else None
+    if jpeg is None:
+        return error("Could not capture frame", 404)
+
+    frame_time, _, alerts = record
+    headers = {
+        "X-Snapshot-Timestamp": frame_time.isoformat(),
+        "X-Snapshot-Alerts": str(len(alerts)),
+        "Cache-Control": "no-store",
+    }
+    return jpeg, "image/jpeg", headers, 200
+
+
+def capture_snapshot(camera_id, profile):
+    """Encode one camera for a batch snapshot, returning (manifest entry, jpeg)."""
+    start = time.perf_counter()
+    record = snapshot_record(camera_id)
+    jpeg = encode_jpeg(record[1], profile) if record is not None else None
+    entry = {"camera_id": camera_id, "success": jpeg is not None}
+    if jpeg is None:
+        entry["error"] = "Could not capture frame"
+    else:
+        entry.update(timestamp=record[0].isoformat(), alerts=record[2], bytes=len(jpeg))
+    entry["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return entry, jpeg
+
+
+snapshot_pool = ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS, thread_name_prefix="snapshot")
+
+
+def multipart_body(boundary, parts):
+    """Join (headers, body) parts into a multipart/mixed body."""
+    chunks = []
+    for headers, body in parts:
+        head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        chunks.append(f"--{boundary}\r\n{head}\r\n".encode("utf-8") + body + b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(chunks)
+
+
+@app.route('/api/cameras/snapshots', methods=['GET', 'POST'])
+def get_snapshots():
+    """Snapshots of many cameras in one round trip.
+
+    Cameras come from ``?cameras=a,b`` or a JSON body ``{"cameras": [...]}``.
+    ``format=multipart`` (default) returns a JSON manifest part followed by
+    one image/jpeg part per captured camera; ``format=json`` returns only
+    the manifest with per-camera timings and errors.
+    """
+    if request.method == 'POST':
+        options = request.get_json(silent=True)
+        if not isinstance(options, dict):
+            return jsonify({"success": False, "error": "Expected a list of cameras"}), 400
+        camera_ids = options.get("cameras")
+    else:
+        options = request.args
+        camera_ids = [cam for cam in request.args.get('cameras', '').split(',') if cam]
+    fmt = options.get("format", "multipart")
+    profile = options.get("profile", DEFAULT_STREAM_PROFILE)
+
+    if not camera_ids or not isinstance(camera_ids, list):
+        return jsonify({"success": False, "error": "Expected a list of cameras"}), 400
+    if len(camera_ids) > SNAPSHOT_BATCH_LIMIT:
+        return jsonify({"success": False,
+                        "error": f"At most {SNAPSHOT_BATCH_LIMIT} cameras per request"}), 400
+    if fmt not in ("multipart", "json"):
+        return jsonify({"success": False, "error": f"Unknown format: {fmt}"}), 400
+    if profile not in STREAM_PROFILES:
+        return jsonify({"success": False, "error": f"Unknown stream profile: {profile}"}), 400
+
+    start = time.perf_counter()
+    # cv2.imencode releases the GIL, so cameras really are encoded in parallel
+    results = list(snapshot_pool.map(lambda cam: capture_snapshot(str(cam), profile), camera_ids))
+    manifest = {
+        "success": any(entry["success"] for entry, _ in results),
+        "profile": profile,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        "cameras": [entry for entry, _ in results],
+    }
+    if fmt == "json":
+        return jsonify(manifest)
+
+    parts = [({"Content-Type": "application/json"}, json.dumps(manifest).encode("utf-8"))]
+    for entry, jpeg in results:
+        if jpeg is not None:
+            parts.append(({
+                "Content-Type": "image/jpeg",
+                "Content-Disposition": f'inline; name="{entry["camera_id"]}"',
+                "Content-Length": len(jpeg),
+                "X-Camera-Id": entry["camera_id"],
+                "X-Snapshot-Timestamp": entry["timestamp"],
+            }, jpeg))
+    boundary = uuid.uuid4().hex
+    return Response(multipart_body(boundary, parts), mimetype=f'multipart/mixed; boundary={boundary}')
+
+@app.route('/api/cameras/<camera_id>/snapshot')
+def get_snapshot(camera_id):
+    if request.args.get('format') == 'jpeg':
+        body, content_type, headers, status = snapshot_image(
+            camera_id, request.args.get('at'), request.args.get('profile', DEFAULT_STREAM_PROFILE)
+        )
+        return Response(body, status=status, mimetype=content_type, headers=headers)
+
+    payload, status = snapshot_payload(
+        camera_id, request.args.get('at'), request.args.get('last', type=int)
+    )
+    return jsonify(payload), status
+
+def admin_denied():
+    """Error response for an admin action, or None if the request may go ahead.
+
+    The service listens on every interface with CORS open to any origin, so
+    admin actions stay disabled until AI_ADMIN_TOKEN is configured.
+    """
+    if ADMIN_TOKEN is None:
+        return jsonify({"success": False,
+                        "message": "Admin actions are disabled; set AI_ADMIN_TOKEN"}), 403
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+    return None
+
+@app.route('/api/admin/model')
+def get_model_status():
+    if CAMERA_PROCESSES:
+        # The front end runs no inference; the shards hold the models in use
+        return jsonify({"shards": [dict(shard.model, shard=shard.index) for shard in camera_shards]})
+    return jsonify(model_registry.status())
+
+@app.route('/api/admin/model/reload', methods=['POST'])
+def reload_model():
+    denied = admin_denied()
+    if denied:
+        return denied
+
+    data = request.get_json(silent=True) or {}
+    backend = data.get("backend", model_registry.backend_name() or INFERENCE_BACKEND)
+    path = data.get("path")
+
+    if backend not in INFERENCE_BACKENDS:
+        return jsonify({"success": False, "message": f"Unknown backend: {backend}"}), 400
+    if path is not None:
+        # Only model files shipped alongside the service can be loaded
+        path = os.path.realpath(os.path.join(MODEL_DIR, path))
+        if os.path.commonpath([path, MODEL_DIR]) != MODEL_DIR or not os.path.isfile(path):
+            return jsonify({"success": False, "message": "Model file not found"}), 400
+
+    if CAMERA_PROCESSES:
+        replies = reload_shard_models(backend, path)
+        failed = [reply for reply in replies if not reply["success"]]
+        return jsonify({
+            "success": not failed,
+            "message": "Model reloaded" if not failed else f"Reload failed in {len(failed)} shard(s)",
+            "shards": replies
+        }), 500 if failed else 200
+
+    try:
+        status = model_registry.load(backend, path)
+    except RuntimeError as e:
+        return jsonify({"success": False, "message": str(e), "model": model_registry.status()}), 500
+
+    return jsonify({"success": True, "message": "Model reloaded", "model": status})
+
+@app.route('/api/analysis', methods=['POST'])
+def run_analysis():
+    """Analyse recorded footage, streaming progress and segment results as NDJSON."""
+    denied = admin_denied()
+    if denied:
+        return denied
+
+    data = request.get_json(silent=True) or {}
+    videos = data.get("videos")
+    if not videos or not isinstance(videos, list):
+        return jsonify({"success": False, "message": "Expected a list of videos"}), 400
+
+    footage_dir = os.path.realpath(FOOTAGE_DIR)
+    paths = []
+    for video in videos:
+        # Only footage under FOOTAGE_DIR can be analysed
+        path = os.path.realpath(os.path.join(footage_dir, str(video)))
+        if os.path.commonpath([path, footage_dir]) != footage_dir or not os.path.isfile(path):
+            return jsonify({"success": False, "message": f"Video not found: {video}"}), 400
+        paths.append(path)
+
+    # Imported here: the analysis workers import this module by name themselves
+    import analyze
+    try:
+        records = analyze.analyze_videos(
+            paths,
+            stride=max(1, int(data.get("stride", analyze.FRAME_STRIDE))),
+            segment_seconds=float(data.get("segmentSeconds", analyze.SEGMENT_SECONDS)),
+            # Every worker loads its own model, so never more than one per core
+            workers=max(1, min(int(data.get("workers", analyze.WORKERS)), analyze.WORKERS)),
+            detector=data.get("detector", FACE_DETECTOR),
+            backend=model_registry.backend_name(),
+            model_path=model_registry.status().get("path")
+        )
+        first = next(records)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    def stream():
+        yield json.dumps(first) + "\n"
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+    return Response(stream(), mimetype='application/x-ndjson')
 
 @app.route('/api/cameras')
 def get_cameras():
-    return jsonify(CAMERAS)
+    return jsonify(camera_registry.all())
 
 @app.route('/api/cameras/<camera_id>')
 def get_camera_info(camera_id):
-    camera = next((cam for cam in CAMERAS if cam["_id"] == camera_id), None)
+    camera = camera_registry.get(camera_id)
     if camera:
         return jsonify(camera)
     else:
@@ -350,4 +2884,12 @@ def get_camera_info(camera_id):
 if __name__ == '__main__':
     print("[INFO] Starting Flask AI Surveillance API...")
     print("[INFO] Waiting for camera configuration via /api/all-cameras endpoint")
-    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
+    debug = True
+    # With the reloader only the serving child process should load the model
+    # or replay the alert spool
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        alert_dispatcher.start()
+        if not CAMERA_PROCESSES:
+            evidence_store.start()
+            model_registry.ensure_loading()
+    app.run(host='0.0.0.0', port=5000, debug=debug, threaded=True)
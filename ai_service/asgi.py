@@ -0,0 +1,236 @@
+"""Asyncio serving mode for the AI Surveillance API.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+``/video_feed/<camera_id>`` and ``/api/cameras/<camera_id>/snapshot`` are
+served natively so an open stream costs a coroutine instead of an OS thread;
+every other route falls through to the Flask app unchanged. Each watched
+camera profile gets one pump thread that relays the shared encoded frames
+to small per-client queues, dropping the oldest frame for clients that
+cannot keep up.
+
+Requires ``uvicorn`` and ``asgiref`` (not needed for the Flask server):
+
+    pip install -r requirements.txt -r requirements-asgi.txt
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as service
+from app import metrics
+
+CLIENT_QUEUE_SIZE = 2   # frames buffered per viewer before the oldest is dropped
+
+CORS_HEADER = (b"access-control-allow-origin", b"*")
+
+flask_application = WsgiToAsgi(service.app)
+
+
+# ------------- Feed Broadcasting -------------
+class FeedBroadcaster:
+    """Fans one camera profile's encoded frames out to client queues.
+
+    Client bookkeeping happens on the event loop; the pump thread only waits
+    for the shared JPEG bytes and hands each chunk back to the loop.
+    """
+
+    def __init__(self, camera_id, worker, profile, loop):
+        self.camera_id = camera_id
+        self.worker = worker
+        self.stream = service.get_encoded_stream(worker, profile)
+        self.loop = loop
+        self.clients = set()
+        self._stop = None
+
+    def attach(self):
+        client = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.clients.add(client)
+        self.worker.viewers += 1
+        if self._stop is None:
+            self._stop = threading.Event()
+            threading.Thread(target=self._pump, args=(self._stop,), daemon=True).start()
+        return client
+
+    def detach(self, client):
+        self.clients.discard(client)
+        self.worker.viewers -= 1
+        if not self.clients and self._stop is not None:
+            # The pump notices after its current wait; a new viewer starts a fresh one
+            self._stop.set()
+            self._stop = None
+
+    def _pump(self, stop):
+        self.stream.attach()
+        last_id = 0
+        try:
+            while not stop.is_set():
+                jpeg, jpeg_id = self.stream.wait(last_id)
+                if jpeg is None:
+                    if not self.worker.is_alive():
+                        break
+                    continue
+                last_id = jpeg_id
+                chunk = (b'--frame\r\n'
+                         b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+                if not stop.is_set():
+                    self.loop.call_soon_threadsafe(self._fan_out, chunk)
+        finally:
+            self.stream.detach()
+        self.loop.call_soon_threadsafe(self._finish, stop)
+
+    def _offer(self, client, chunk):
+        if client.full():
+            client.get_nowait()
+            metrics.inc("frames_dropped", self.camera_id)
+        client.put_nowait(chunk)
+
+    def _fan_out(self, chunk):
+        for client in self.clients:
+            self._offer(client, chunk)
+
+    def _finish(self, stop):
+        if stop.is_set():
+            return
+        # The camera worker stopped: end every open stream
+        self._stop = None
+        for client in self.clients:
+            self._offer(client, None)
+
+
+broadcasters = {}
+
+
+def get_broadcaster(camera_id, worker, profile):
+    broadcaster = broadcasters.get((camera_id, profile))
+    if broadcaster is None or broadcaster.worker is not worker:
+        # Workers are replaced when their configuration changes
+        broadcaster = FeedBroadcaster(camera_id, worker, profile, asyncio.get_running_loop())
+        broadcasters[camera_id, profile] = broadcaster
+    return broadcaster
+
+
+# ------------- Handlers -------------
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def query_params(scope):
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return {key: values[0] for key, values in query.items()}
+
+
+async def send_json(send, payload, status=200):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), CORS_HEADER],
+    })
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode("utf-8")})
+
+
+async def video_feed(scope, receive, send, camera_id):
+    profile = query_params(scope).get("profile", service.DEFAULT_STREAM_PROFILE)
+    if profile not in service.STREAM_PROFILES:
+        return await send_json(send, {
+            "error": f"Unknown stream profile: {profile}",
+            "profiles": list(service.STREAM_PROFILES)
+        }, 400)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"multipart/x-mixed-replace; boundary=frame"), CORS_HEADER],
+    })
+
+    worker = service.get_camera_worker(camera_id)
+    if worker is None:
+        print(f"[ERROR] No camera worker running for camera: {camera_id}")
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    print(f"[INFO] Viewer attached to camera: {camera_id} ({profile})")
+    broadcaster = get_broadcaster(camera_id, worker, profile)
+    client = broadcaster.attach()
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+
+    try:
+        while True:
+            chunk = asyncio.ensure_future(client.get())
+            await asyncio.wait({chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                chunk.cancel()
+                return
+            if chunk.result() is None:
+                break
+            await send({"type": "http.response.body", "body": chunk.result(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        broadcaster.detach(client)
+        print(f"[INFO] Viewer detached from camera: {camera_id} ({profile})")
+
+
+async def snapshot(scope, receive, send, camera_id):
+    query = query_params(scope)
+    loop = asyncio.get_running_loop()
+    if query.get("format") == "jpeg":
+        body, content_type, headers, status = await loop.run_in_executor(
+            None, service.snapshot_image, camera_id, query.get("at"),
+            query.get("profile", service.DEFAULT_STREAM_PROFILE)
+        )
+        raw_headers = [(b"content-type", content_type.encode()), CORS_HEADER]
+        raw_headers += [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+        await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    try:
+        last = int(query["last"]) if "last" in query else None
+    except ValueError:
+        last = None
+
+    # Decoding history frames and JPEG encoding stay off the event loop
+    payload, status = await loop.run_in_executor(
+        None, service.snapshot_payload, camera_id, query.get("at"), last
+    )
+    await send_json(send, payload, status)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            print("[INFO] Starting ASGI AI Surveillance API...")
+            print("[INFO] Waiting for camera configuration via /api/all-cameras endpoint")
+            service.alert_dispatcher.start()
+            if not service.CAMERA_PROCESSES:
+                service.evidence_store.start()
+                service.model_registry.ensure_loading()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    parts = scope["path"].strip("/").split("/")
+    if scope["type"] == "http" and scope["method"] == "GET":
+        if len(parts) == 2 and parts[0] == "video_feed":
+            return await video_feed(scope, receive, send, parts[1])
+        if len(parts) == 4 and parts[:2] == ["api", "cameras"] and parts[3] == "snapshot":
+            return await snapshot(scope, receive, send, parts[2])
+    return await flask_application(scope, receive, send)
+
+
+# ------------- Main -------------
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=5000)
@@ -1,10 +1,15 @@
 import os
 import cv2
+import json
 import numpy as np
 import random
+from concurrent.futures import ProcessPoolExecutor
 
 DATA_DIR = "./images"
 CLASSES = ["normal face", "with helmet", "with mask"]
+VARIANTS = ["dark", "blur", "noise", "rot"]   # augmentations written for each source image
+WORKERS = os.cpu_count()
+MANIFEST_PATH = os.path.join(DATA_DIR, "augment_manifest.json")
 
 def adjust_brightness(img, factor=0.5):
     return cv2.convertScaleAbs(img, alpha=factor, beta=0)
@@ -13,7 +18,8 @@ def add_blur(img):
     return cv2.GaussianBlur(img, (7,7), 0)
 
 def add_noise(img):
-    noise = np.random.normal(0, 25, img.shape).astype(np.uint8)
+    # Fresh generator per call so forked workers don't share one noise sequence
+    noise = np.random.default_rng().normal(0, 25, img.shape).astype(np.uint8)
     return cv2.add(img, noise)
 
 def rotate_image(img):
@@ -22,31 +28,88 @@ def rotate_image(img):
     M = cv2.getRotationMatrix2D((w/2, h/2), angle, 1)
     return cv2.warpAffine(img, M, (w, h))
 
-def process_class(class_name):
-    folder = os.path.join(DATA_DIR, class_name)
-    images = [f for f in os.listdir(folder) if f.endswith((".jpg", ".png", ".jpeg"))]
+AUGMENTATIONS = {
+    "dark": lambda img: adjust_brightness(img, 0.4),
+    "blur": add_blur,
+    "noise": add_noise,
+    "rot": rotate_image,
+}
 
-    for img_name in images:
-        path = os.path.join(folder, img_name)
-        img = cv2.imread(path)
+def is_augmented(img_name):
+    base = os.path.splitext(img_name)[0]
+    return base.endswith(tuple(f"_{name}" for name in AUGMENTATIONS))
 
+def augment_image(task):
+    """Write the missing variants of one source image; runs in a worker process."""
+    folder, img_name, variants, changed = task
+    base = os.path.splitext(img_name)[0]
+    missing = [
+        v for v in variants
+        if changed or not os.path.exists(os.path.join(folder, f"{base}_{v}.jpg"))
+    ]
+
+    if missing:
+        img = cv2.imread(os.path.join(folder, img_name))
         if img is None:
+            return folder, img_name, None
+        for variant in missing:
+            cv2.imwrite(os.path.join(folder, f"{base}_{variant}.jpg"), AUGMENTATIONS[variant](img))
+
+    return folder, img_name, len(missing)
+
+def load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def collect_tasks(manifest):
+    """Source images that are new, changed or missing a configured variant."""
+    tasks = []
+    for class_name in CLASSES:
+        folder = os.path.join(DATA_DIR, class_name)
+        if not os.path.isdir(folder):
             continue
+        images = [f for f in os.listdir(folder) if f.lower().endswith((".jpg", ".png", ".jpeg"))]
 
-        # Generate augmented versions
-        dark = adjust_brightness(img, 0.4)
-        blur = add_blur(img)
-        noisy = add_noise(img)
-        rotated = rotate_image(img)
+        for img_name in images:
+            if is_augmented(img_name):
+                continue
+            entry = manifest.get(f"{class_name}/{img_name}")
+            mtime = os.path.getmtime(os.path.join(folder, img_name))
+            changed = entry is not None and entry["mtime"] != mtime
+            if entry and not changed and set(VARIANTS) <= set(entry["variants"]):
+                continue
+            tasks.append((folder, img_name, VARIANTS, changed))
+    return tasks
 
-        base = img_name.split(".")[0]
+def main():
+    manifest = load_manifest()
+    tasks = collect_tasks(manifest)
+    print(f"{len(tasks)} source images to augment with {WORKERS} workers")
 
-        cv2.imwrite(os.path.join(folder, f"{base}_dark.jpg"), dark)
-        cv2.imwrite(os.path.join(folder, f"{base}_blur.jpg"), blur)
-        cv2.imwrite(os.path.join(folder, f"{base}_noise.jpg"), noisy)
-        cv2.imwrite(os.path.join(folder, f"{base}_rot.jpg"), rotated)
+    written = 0
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        for folder, img_name, count in pool.map(augment_image, tasks, chunksize=16):
+            if count is None:
+                print("Skipped unreadable:", os.path.join(folder, img_name))
+                continue
+            written += count
+            key = f"{os.path.basename(folder)}/{img_name}"
+            previous = manifest.get(key, {}).get("variants", [])
+            manifest[key] = {
+                "mtime": os.path.getmtime(os.path.join(folder, img_name)),
+                "variants": sorted(set(previous) | set(VARIANTS)),
+            }
 
-for cls in CLASSES:
-    process_class(cls)
+    save_manifest(manifest)
+    print(f"Dataset augmentation completed! {written} new images written")
 
-print("Dataset augmentation completed!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Offline replay benchmark for the detection pipeline.
+
+Feeds local video files or synthetic frames through the same
+CameraWorker.process_frame() path the live service uses, with the Node.js
+alert API replaced by a local stub and the alert spool and evidence images
+kept in a temporary directory, and prints a JSON report:
+
+    python benchmark.py --cameras 1 4 8 --frames 300
+    python benchmark.py --video clip.mp4 --cameras 2 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+import app
+
+
+# -------------------- Alert API stub --------------------
+class StubAlertHandler(BaseHTTPRequestHandler):
+    received = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        type(self).received += 1
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"success": true}')
+
+    def log_message(self, *args):
+        pass
+
+
+def start_alert_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAlertHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.alert_dispatcher.url = f"http://127.0.0.1:{server.server_port}/api/alerts"
+    return server
+
+
+# -------------------- Frame sources --------------------
+def synthetic_frames(width, height, face=None, seed=0):
+    """Endless frames with a bouncing block, or a pasted face image."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    patch = face if face is not None else np.full((120, 120, 3), 200, dtype=np.uint8)
+    ph, pw = patch.shape[:2]
+    x, y = rng.integers(0, width - pw), rng.integers(0, height - ph)
+    dx, dy = 7, 5
+
+    while True:
+        frame = background.copy()
+        frame[y:y + ph, x:x + pw] = patch
+        yield frame
+        if not 0 <= x + dx <= width - pw:
+            dx = -dx
+        if not 0 <= y + dy <= height - ph:
+            dy = -dy
+        x, y = x + dx, y + dy
+
+
+def video_frames(path):
+    """Loop a local video file forever."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"Could not open video: {path}")
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = cap.read()
+                if not ok:
+                    return
+            yield frame
+    finally:
+        cap.release()
+
+
+# -------------------- Benchmark --------------------
+def percentile(values, p):
+    return float(np.percentile(values, p) * 1000) if values else 0.0
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if platform.system() == "Darwin" else rss / 1024
+
+
+def run_camera(worker, frames, count, latencies):
+    for _ in range(count):
+        frame = next(frames, None)
+        if frame is None:
+            break
+        start = time.perf_counter()
+        worker.process_frame(frame)
+        latencies.append(time.perf_counter() - start)
+
+
+def run_scenario(args, num_cameras, face):
+    workers, sources = [], []
+    for i in range(num_cameras):
+        camera_id = f"bench_{i:02d}"
+        workers.append(app.CameraWorker(camera_id, f"bench://{camera_id}", detector=args.detector))
+        if args.video:
+            sources.append(video_frames(args.video[i % len(args.video)]))
+        else:
+            sources.append(synthetic_frames(args.width, args.height, face, seed=i))
+
+    calls_before = app.metrics.counter("inference_calls")
+    faces_before = app.metrics.counter("inference_faces")
+    alerts_before = StubAlertHandler.received
+    latencies = [[] for _ in workers]
+
+    threads = [
+        threading.Thread(target=run_camera, args=(worker, source, args.frames, lat))
+        for worker, source, lat in zip(workers, sources, latencies)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    # Let queued alerts reach the stub before counting them
+    deadline = time.monotonic() + 5
+    while ((app.alert_dispatcher.pending() or app.evidence_store.pending())
+           and time.monotonic() < deadline):
+        time.sleep(0.05)
+
+    all_latencies = [v for lat in latencies for v in lat]
+    total_frames = len(all_latencies)
+    calls = app.metrics.counter("inference_calls") - calls_before
+    return {
+        "cameras": num_cameras,
+        "frames": total_frames,
+        "elapsed_s": round(elapsed, 3),
+        "fps_total": round(total_frames / elapsed, 2) if elapsed else 0.0,
+        "fps_per_camera": round(total_frames / elapsed / num_cameras, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(all_latencies, 50), 3),
+            "p95": round(percentile(all_latencies, 95), 3),
+            "p99": round(percentile(all_latencies, 99), 3),
+        },
+        "inference_calls": calls,
+        "inference_calls_per_frame": round(calls / total_frames, 4) if total_frames else 0.0,
+        "faces_classified": app.metrics.counter("inference_faces") - faces_before,
+        "alerts_delivered": StubAlertHandler.received - alerts_before,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay benchmark for the detection pipeline")
+    parser.add_argument("--video", nargs="*", default=[], help="local video files, reused round-robin")
+    parser.add_argument("--cameras", nargs="+", type=int, default=[1], help="simulated camera counts")
+    parser.add_argument("--frames", type=int, default=300, help="frames per camera")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--face-image", help="image pasted into synthetic frames")
+    parser.add_argument("--detector", default=app.FACE_DETECTOR, choices=["haar", "dnn"])
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    face = cv2.imread(args.face_image) if args.face_image else None
+    app.model_registry.load(app.INFERENCE_BACKEND)
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_", ignore_cleanup_errors=True) as workdir:
+        # Set before the first alert starts the dispatcher and evidence writer,
+        # so the service's own spool and evidence quota are never touched
+        app.alert_dispatcher.spool_path = os.path.join(workdir, "pending.jsonl")
+        app.evidence_store.root = os.path.join(workdir, "alert_images")
+        stub = start_alert_stub()
+
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "backend": app.model_registry.backend_name(),
+            "source": args.video or f"synthetic {args.width}x{args.height}",
+            "scenarios": [run_scenario(args, n, face) for n in args.cameras],
+        }
+        stub.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print("Benchmark report saved to", args.output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,20 @@ import numpy as np
 import random
 import json
 import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pickle
 import tensorflow as tf
 from tensorflow.keras import layers, models, callbacks, optimizers
 from sklearn.model_selection import train_test_split
 from sklearn.utils import class_weight
 from sklearn.metrics import classification_report, confusion_matrix
 
+try:
+    import tf2onnx
+except ImportError:
+    tf2onnx = None
+
 # -------------------- Configuration --------------------
 Data_directory = './images'
 Classes = ['normal face', 'with helmet', 'with mask']
@@ -21,14 +27,26 @@ SEED = 42
 EPOCHS_INITIAL = 6    
 EPOCHS_FINE = 12      
 PATIENCE = 4
+EXPORT_TFLITE = True
+QUANTIZE_INT8 = False          # post-training INT8 quantization calibrated on X_test
+CALIBRATION_SAMPLES = 200
+EXPORT_ONNX = True             # only when tf2onnx is installed
+USE_CACHE = True               # reuse resized images from CACHE_DIR between runs
+CACHE_DIR = './cache'
+CACHE_SHARD_SIZE = 2048        # images per memory-mapped .npy shard
+CACHE_HASH_CONTENT = False     # key files by content hash instead of size + mtime
+CACHE_FEATURES = True          # train the frozen-phase head on cached backbone features
+FEATURE_AUGMENT_PASSES = 2     # extra augmented passes over the training set
+EPOCHS_HEAD = 40               # head epochs on cached features (each takes seconds)
 
 
 # -------------------- Helpers --------------------
 def list_image_files(path):
     return [f for f in os.listdir(path) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
 
-def load_images_and_labels():
-    X = []
+def list_samples():
+    """Collect image paths and labels without decoding anything."""
+    paths = []
     y = []
     counts = {}
     for idx, cls in enumerate(Classes):
@@ -40,27 +58,17 @@ def load_images_and_labels():
         counts[cls] = len(files)
         print(f"Found {len(files)} images for class '{cls}'")
         for fname in files:
-            try:
-                img_path = os.path.join(cls_path, fname)
-                img = cv2.imread(img_path)
-                if img is None:
-                    print("Skipped unreadable:", img_path)
-                    continue
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                img = cv2.resize(img, (IMG_SIZE, IMG_SIZE))
-                X.append(img)
-                y.append(idx)
-            except Exception as e:
-                print(f"Error reading {fname}: {e}")
-    X = np.array(X, dtype=np.float32) / 255.0
+            paths.append(os.path.join(cls_path, fname))
+            y.append(idx)
+    paths = np.array(paths)
     y = np.array(y, dtype=np.int32)
     print("Total samples:", len(y))
-    return X, y, counts
+    return paths, y, counts
 
 
 
 # -------------------- Data Loading --------------------
-X, y, class_counts = load_images_and_labels()
+paths, y, class_counts = list_samples()
 
 if len(y) == 0:
     raise SystemExit("No training images found. Put images inside ./images/<class_name>/")
@@ -75,36 +83,169 @@ print("Class weights:", class_weights_dict)
 
 # -------------------- Train/Test Split --------------------
 X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=SEED, stratify=y
+    paths, y, test_size=0.2, random_state=SEED, stratify=y
 )
 
 print(f"Train samples: {len(y_train)}, Test samples: {len(y_test)}")
 
 
 
+# -------------------- Preprocessed image cache --------------------
+def read_image(path):
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return cv2.resize(img, (IMG_SIZE, IMG_SIZE))
+
+
+class PreprocessedCache:
+    """Resized uint8 images stored in memory-mapped .npy shards.
+
+    Every file is keyed by its path plus size and mtime (or content hash),
+    and the cache directory by IMG_SIZE and Classes, so a run only decodes
+    images that were added or changed. Shards whose images were all
+    removed are deleted.
+    """
+
+    def __init__(self, root=CACHE_DIR):
+        spec = json.dumps({"img_size": IMG_SIZE, "classes": Classes})
+        self.dir = os.path.join(root, hashlib.sha1(spec.encode()).hexdigest()[:12])
+        os.makedirs(self.dir, exist_ok=True)
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.entries = {}   # file key -> [shard name, row]
+        self.keys = {}      # path -> file key for the current run
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.entries = json.load(f)["entries"]
+        self._shards = {}
+
+    @staticmethod
+    def file_key(path):
+        if CACHE_HASH_CONTENT:
+            with open(path, "rb") as f:
+                stamp = hashlib.sha1(f.read()).hexdigest()
+        else:
+            st = os.stat(path)
+            stamp = f"{st.st_size}:{st.st_mtime_ns}"
+        return hashlib.sha1(f"{os.path.abspath(path)}|{stamp}".encode()).hexdigest()
+
+    def update(self, paths):
+        self.keys = {path: self.file_key(path) for path in paths}
+        live = set(self.keys.values())
+        stale = [key for key in self.entries if key not in live]
+        for key in stale:
+            del self.entries[key]
+
+        missing = [path for path, key in self.keys.items() if key not in self.entries]
+        for start in range(0, len(missing), CACHE_SHARD_SIZE):
+            self._write_shard(missing[start:start + CACHE_SHARD_SIZE])
+
+        used = {entry[0] for entry in self.entries.values() if entry}
+        for name in os.listdir(self.dir):
+            if name.endswith(".npy") and name not in used:
+                os.remove(os.path.join(self.dir, name))
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"img_size": IMG_SIZE, "classes": Classes, "entries": self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+        print(f"Cache: {len(paths) - len(missing)} reused, {len(missing)} decoded, {len(stale)} removed")
+
+    def _write_shard(self, paths):
+        name = f"shard_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.npy"
+        shard = np.lib.format.open_memmap(
+            os.path.join(self.dir, name), mode="w+", dtype=np.uint8,
+            shape=(len(paths), IMG_SIZE, IMG_SIZE, 3)
+        )
+        with ThreadPoolExecutor() as pool:
+            for row, (path, img) in enumerate(zip(paths, pool.map(read_image, paths))):
+                if img is None:
+                    # Remembered so unreadable files are not retried every run
+                    print("Skipped unreadable:", path)
+                    self.entries[self.keys[path]] = None
+                    continue
+                shard[row] = img
+                self.entries[self.keys[path]] = [name, row]
+        shard.flush()
+        del shard
+
+    def _shard(self, name):
+        if name not in self._shards:
+            self._shards[name] = np.load(os.path.join(self.dir, name), mmap_mode="r")
+        return self._shards[name]
+
+    def dataset(self, paths, labels, shuffle=False):
+        rows = [
+            (self.entries[self.keys[path]], label)
+            for path, label in zip(paths, labels)
+            if self.entries.get(self.keys.get(path))
+        ]
+        rng = np.random.default_rng(SEED)
+
+        def generate():
+            order = rng.permutation(len(rows)) if shuffle else range(len(rows))
+            for i in order:
+                (shard, row), label = rows[i]
+                yield self._shard(shard)[row], label
+
+        return tf.data.Dataset.from_generator(generate, output_signature=(
+            tf.TensorSpec((IMG_SIZE, IMG_SIZE, 3), tf.uint8),
+            tf.TensorSpec((), tf.int32),
+        ))
+
+
+preprocessed_cache = None
+if USE_CACHE:
+    preprocessed_cache = PreprocessedCache()
+    preprocessed_cache.update(list(paths))
+
+
+
 # -------------------- Build tf.data pipelines --------------------
 AUTOTUNE = tf.data.AUTOTUNE
 
-def make_dataset(images, labels, shuffle=True, augment=False):
-    ds = tf.data.Dataset.from_tensor_slices((images, labels))
+def load_image(path, label):
+    # Images stay uint8 until batching so memory does not scale with the dataset
+    data = tf.io.read_file(path)
+    img = tf.io.decode_image(data, channels=3, expand_animations=False)
+    img = tf.image.resize(img, (IMG_SIZE, IMG_SIZE))
+    img = tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8)
+    return img, label
+
+def decode_dataset(paths, labels, shuffle=False):
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
     if shuffle:
-        ds = ds.shuffle(buffer_size=1000, seed=SEED)
+        ds = ds.shuffle(buffer_size=len(paths), seed=SEED, reshuffle_each_iteration=True)
+    ds = ds.map(load_image, num_parallel_calls=AUTOTUNE)
+    ds = ds.apply(tf.data.experimental.ignore_errors())
+    return ds
+
+def image_dataset(paths, labels, shuffle=False):
+    if preprocessed_cache is not None:
+        return preprocessed_cache.dataset(paths, labels, shuffle=shuffle)
+    return decode_dataset(paths, labels, shuffle=shuffle)
+
+data_augmentation = tf.keras.Sequential([
+    layers.RandomFlip("horizontal"),
+    layers.RandomRotation(0.06),
+    layers.RandomZoom(0.08),
+    layers.RandomTranslation(0.05, 0.05),
+])
+
+def make_dataset(paths, labels, shuffle=True, augment=False):
+    ds = image_dataset(paths, labels, shuffle=shuffle)
+    ds = ds.batch(BATCH_SIZE)
     def _preprocess(img, label):
         img = tf.image.convert_image_dtype(img, tf.float32)
         return img, label
     ds = ds.map(_preprocess, num_parallel_calls=AUTOTUNE)
     if augment:
-        data_augmentation = tf.keras.Sequential([
-            layers.RandomFlip("horizontal"),
-            layers.RandomRotation(0.06),
-            layers.RandomZoom(0.08),
-            layers.RandomTranslation(0.05, 0.05),
-        ])
         def _augment(img, label):
             img = data_augmentation(img, training=True)
             return img, label
         ds = ds.map(_augment, num_parallel_calls=AUTOTUNE)
-    ds = ds.batch(BATCH_SIZE).prefetch(AUTOTUNE)
+    ds = ds.prefetch(AUTOTUNE)
     return ds
 
 
@@ -124,12 +265,13 @@ base_model.trainable = False
 inputs = layers.Input(shape=(IMG_SIZE, IMG_SIZE, 3))
 x = layers.Rescaling(1.0)(inputs)
 x = base_model(x, training=False)
-x = layers.GlobalAveragePooling2D()(x)
-x = layers.Dense(256, activation='relu')(x)
+features = layers.GlobalAveragePooling2D()(x)
+x = layers.Dense(256, activation='relu', name='head_dense')(features)
 x = layers.Dropout(0.4)(x)
-outputs = layers.Dense(len(Classes), activation='softmax')(x)
+outputs = layers.Dense(len(Classes), activation='softmax', name='head_output')(x)
 
 model = models.Model(inputs, outputs)
+feature_extractor = models.Model(inputs, features)
 
 model.compile(
     optimizer=optimizers.Adam(learning_rate=1e-3),
@@ -151,16 +293,79 @@ cb_ckpt = callbacks.ModelCheckpoint(checkpoint_path, save_best_only=True, monito
 cb_reduce = callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=2, min_lr=1e-6)
 
 
+# -------------------- Cached backbone features --------------------
+def feature_cache_path():
+    # Any change to the images, split, augmentation passes or input size
+    # gives a new key, so stale features are never reused.
+    file_key = preprocessed_cache.keys.get if preprocessed_cache else PreprocessedCache.file_key
+    keys = [file_key(p) for p in X_train] + ["|"] + [file_key(p) for p in X_test]
+    spec = f"{IMG_SIZE}|{SEED}|{FEATURE_AUGMENT_PASSES}|{base_model.name}|" + ",".join(keys)
+    key = hashlib.sha1(spec.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, "features", f"features_{key}.npz")
+
+def extract_features(paths, labels, augment_passes=0):
+    feats, ys = [], []
+    for p in range(1 + augment_passes):
+        for images, batch_labels in make_dataset(paths, labels, shuffle=False, augment=p > 0):
+            feats.append(feature_extractor.predict_on_batch(images))
+            ys.append(batch_labels.numpy())
+    return np.concatenate(feats), np.concatenate(ys)
+
+def load_or_extract_features():
+    path = feature_cache_path()
+    if os.path.exists(path):
+        print("Loading cached backbone features from", path)
+        with np.load(path) as data:
+            return data["train_x"], data["train_y"], data["val_x"], data["val_y"]
+
+    print(f"Extracting backbone features ({1 + FEATURE_AUGMENT_PASSES} training passes)")
+    train_x, train_y = extract_features(X_train, y_train, FEATURE_AUGMENT_PASSES)
+    val_x, val_y = extract_features(X_test, y_test)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, train_x=train_x, train_y=train_y, val_x=val_x, val_y=val_y)
+    print("Saved backbone features to", path)
+    return train_x, train_y, val_x, val_y
+
+def build_head():
+    # Same layers and names as the classifier on top of the backbone
+    head_inputs = layers.Input(shape=(features.shape[-1],))
+    x = layers.Dense(256, activation='relu', name='head_dense')(head_inputs)
+    x = layers.Dropout(0.4)(x)
+    head_outputs = layers.Dense(len(Classes), activation='softmax', name='head_output')(x)
+    return models.Model(head_inputs, head_outputs)
+
+
 # -------------------- Initial training --------------------
 print("=== Starting initial training (backbone frozen) ===")
-history1 = model.fit(
-    train_ds,
-    validation_data=val_ds,
-    epochs=EPOCHS_INITIAL,
-    callbacks=[cb_early, cb_ckpt, cb_reduce],
-    class_weight=class_weights_dict,
-    verbose=1
-)
+if CACHE_FEATURES:
+    train_x, train_y, val_x, val_y = load_or_extract_features()
+    head = build_head()
+    head.compile(
+        optimizer=optimizers.Adam(learning_rate=1e-3),
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    history1 = head.fit(
+        train_x, train_y,
+        validation_data=(val_x, val_y),
+        batch_size=BATCH_SIZE,
+        epochs=EPOCHS_HEAD,
+        callbacks=[cb_early, cb_reduce],
+        class_weight=class_weights_dict,
+        verbose=1
+    )
+    # Fine-tuning starts from the head trained on cached features
+    for name in ('head_dense', 'head_output'):
+        model.get_layer(name).set_weights(head.get_layer(name).get_weights())
+else:
+    history1 = model.fit(
+        train_ds,
+        validation_data=val_ds,
+        epochs=EPOCHS_INITIAL,
+        callbacks=[cb_early, cb_ckpt, cb_reduce],
+        class_weight=class_weights_dict,
+        verbose=1
+    )
 
 
 # -------------------- Fine-tuning --------------------
@@ -196,16 +401,18 @@ history2 = model.fit(
 
 # -------------------- Evaluate --------------------
 print("=== Evaluation on test set ===")
-y_pred_probs = model.predict(val_ds, verbose=1)
-y_pred = np.argmax(y_pred_probs, axis=1)
-
-y_test_preds = np.argmax(model.predict(X_test, verbose=0), axis=1)
+# Labels come from the dataset itself since unreadable files are skipped
+y_true = []
+y_pred = []
+for images, labels in val_ds:
+    y_true.extend(labels.numpy())
+    y_pred.extend(np.argmax(model.predict_on_batch(images), axis=1))
 
 print("Classification Report:")
-print(classification_report(y_test, y_test_preds, target_names=Classes))
+print(classification_report(y_true, y_pred, labels=range(len(Classes)), target_names=Classes))
 
 print("Confusion Matrix:")
-print(confusion_matrix(y_test, y_test_preds))
+print(confusion_matrix(y_true, y_pred, labels=range(len(Classes))))
 
 
 
@@ -214,6 +421,39 @@ final_model_path = "face_model_finetuned.h5"
 model.save(final_model_path)
 print("Saved finetuned model to", final_model_path)
 
+exported_models = {"keras": final_model_path}
+
+
+# -------------------- Export TFLite / ONNX --------------------
+def representative_dataset():
+    for images, _ in val_ds.unbatch().take(CALIBRATION_SAMPLES).batch(1):
+        yield [images]
+
+if EXPORT_TFLITE:
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    tflite_path = "face_model.tflite"
+    if QUANTIZE_INT8:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+        tflite_path = "face_model_int8.tflite"
+    with open(tflite_path, "wb") as f:
+        f.write(converter.convert())
+    exported_models["tflite"] = tflite_path
+    print("Saved TFLite model to", tflite_path)
+
+if EXPORT_ONNX:
+    if tf2onnx is None:
+        print("Skipping ONNX export: tf2onnx is not installed")
+    else:
+        onnx_path = "face_model.onnx"
+        spec = (tf.TensorSpec((None, IMG_SIZE, IMG_SIZE, 3), tf.float32, name="input"),)
+        tf2onnx.convert.from_keras(model, input_signature=spec, output_path=onnx_path)
+        exported_models["onnx"] = onnx_path
+        print("Saved ONNX model to", onnx_path)
+
 model_info = {
     "training_date": datetime.now().isoformat(),
     "classes": Classes,
@@ -221,14 +461,26 @@ model_info = {
     "train_samples": int(len(y_train)),
     "test_samples": int(len(y_test)),
     "class_counts": class_counts,
+    "exported_models": exported_models,
 }
 
 with open("model_info.json", "w") as f:
     json.dump(model_info, f, indent=2)
 
-with open("X_test.pickle", "wb") as f:
-    pickle.dump(X_test, f)
-with open("Y_test.pickle", "wb") as f:
-    pickle.dump(y_test, f)
+# Memory-mappable test set: np.load("X_test.npy", mmap_mode="r")
+X_test_images = np.lib.format.open_memmap(
+    "X_test.npy", mode="w+", dtype=np.uint8, shape=(len(X_test), IMG_SIZE, IMG_SIZE, 3)
+)
+Y_test_labels = []
+for row, (img, label) in enumerate(image_dataset(X_test, y_test).as_numpy_iterator()):
+    X_test_images[row] = img
+    Y_test_labels.append(label)
+X_test_images.flush()
+del X_test_images
+if len(Y_test_labels) < len(X_test):
+    # Unreadable images were skipped; trim the unused rows
+    np.save("X_test.tmp.npy", np.load("X_test.npy", mmap_mode="r")[:len(Y_test_labels)])
+    os.replace("X_test.tmp.npy", "X_test.npy")
+np.save("Y_test.npy", np.array(Y_test_labels, dtype=np.int32))
 
 print("Training complete. Model info saved to model_info.json")
\ No newline at end of file
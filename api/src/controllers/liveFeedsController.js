@@ -44,6 +44,7 @@ export const getVideoFeed = async (req, res) => {
             const response = await axios({
                 method: 'get',
                 url: `${FLASK_API}/video_feed/${req.params.cameraId}`,
+                params: { profile: req.query.profile },
                 responseType: 'stream'
             });
 
@@ -56,4 +57,29 @@ export const getVideoFeed = async (req, res) => {
         console.error('Error proxying video feed:', error.message);
         res.status(500).json({ error: 'Failed to get video feed' });
     }
-};
\ No newline at end of file
+};
+
+export const getSnapshots = async (req, res) => {
+    try {
+        const flaskHealthy = await checkFlaskHealth();
+        if (flaskHealthy) {
+            const response = await axios({
+                method: 'get',
+                url: `${FLASK_API}/api/cameras/snapshots`,
+                params: req.query,
+                responseType: 'stream',
+                validateStatus: () => true
+            });
+
+            // Only the content type carries over; hop-by-hop headers belong to the upstream connection
+            res.status(response.status);
+            res.set('Content-Type', response.headers['content-type']);
+            response.data.pipe(res);
+        } else {
+            res.status(503).json({ error: 'Snapshots not available in mock mode' });
+        }
+    } catch (error) {
+        console.error('Error proxying snapshots:', error.message);
+        res.status(500).json({ error: 'Failed to get snapshots' });
+    }
+};
@@ -59,6 +59,11 @@ const alertSchema = new mongoose.Schema(
             type: String,
             default: null,
         },
+
+        thumbnailPath: {
+            type: String,
+            default: null,
+        },
     },
     {
         timestamps: true,
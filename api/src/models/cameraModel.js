@@ -46,6 +46,19 @@ const cameraSchema = new mongoose.Schema({
     streamUrl: {
         type: String,
     },
+    motionSensitivity: {
+        type: Number,
+        min: 0,
+        max: 1,
+    },
+    detector: {
+        type: String,
+        enum: ["haar", "dnn"],
+    },
+    roi: {
+        type: [[Number]],
+        default: undefined,
+    },
     status: {
         type: String,
         enum: ["online", "offline"],
@@ -1,6 +1,7 @@
 import express from 'express';
 import {
     getCameraStatus,
+    getSnapshots,
     getVideoFeed
 } from '../controllers/liveFeedsController.js';
 
@@ -8,5 +9,6 @@ const router = express.Router();
 
 router.get('/cameras/:id/status', getCameraStatus);
 router.get('/video_feed/:cameraId', getVideoFeed);
+router.get('/snapshots', getSnapshots);
 
 export default router;
\ No newline at end of file
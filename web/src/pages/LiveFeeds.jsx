@@ -83,12 +83,14 @@ export default function LiveFeeds() {
     }, [recording]);
 
     // Set up video stream - using camera._id instead of camera.id
+    // The grid only needs a reduced tier; full resolution is streamed in fullscreen
     useEffect(() => {
       if (camera.status === 'online') {
-        setStreamUrl(`http://localhost:3001/api/liveFeeds/video_feed/${camera._id}`);
+        const profile = isFs ? 'full' : 'medium';
+        setStreamUrl(`http://localhost:3001/api/liveFeeds/video_feed/${camera._id}?profile=${profile}`);
         setStreamError(false);
       }
-    }, [camera._id, camera.status]);
+    }, [camera._id, camera.status, isFs]);
 
     const formatTime = (s) => {
       const m = Math.floor(s / 60).toString().padStart(2, "0");